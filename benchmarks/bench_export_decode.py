@@ -0,0 +1,119 @@
+import json
+import sys
+import time
+from typing import Annotated
+
+from pydantic import BaseModel, Discriminator, Tag
+from synthetic_export import synthetic_export_bytes
+
+from matrix_room_import.export_file_model import (
+    CreateEvent,
+    EncryptionEvent,
+    GenericEvent,
+    GuestAccessEvent,
+    HistoryVisibilityEvent,
+    JoinRulesEvent,
+    MemberEvent,
+    MessageEvent,
+    PowerLevelsEvent,
+    ReactionEvent,
+    RedactionEvent,
+    RoomNameEvent,
+    SkippedEvent,
+    SpaceChildEvent,
+    TopicEvent,
+    export_file_adapter,
+)
+
+# Copy of the model decoded with a callable discriminator before
+# export_file_adapter, kept as the baseline of the benchmark.
+skipped_event_types = ["m.room.encrypted"]
+
+event_types = [
+    "m.room.create",
+    "m.room.member",
+    "m.room.encryption",
+    "m.space.child",
+    "m.reaction",
+    "m.room.message",
+    "m.room.redaction",
+    "m.room.topic",
+    "m.room.name",
+    "m.room.history_visibility",
+    "m.room.join_rules",
+    "m.room.guest_access",
+    "m.room.power_levels",
+    "m.room.encryption",
+    "__default__",
+]
+
+
+def get_event_type(event_type) -> str:
+    if isinstance(event_type, dict):
+        t = event_type.get("type", "__default__")
+    else:
+        t = getattr(event_type, "type", "__default__")
+    if t in skipped_event_types:
+        return "__skipped__"
+    if t in event_types:
+        return t
+    return "__default__"
+
+
+OldEvent = Annotated[
+    Annotated[CreateEvent, Tag("m.room.create")]
+    | Annotated[MemberEvent, Tag("m.room.member")]
+    | Annotated[EncryptionEvent, Tag("m.room.encryption")]
+    | Annotated[GuestAccessEvent, Tag("m.room.guest_access")]
+    | Annotated[JoinRulesEvent, Tag("m.room.join_rules")]
+    | Annotated[HistoryVisibilityEvent, Tag("m.room.history_visibility")]
+    | Annotated[RoomNameEvent, Tag("m.room.name")]
+    | Annotated[TopicEvent, Tag("m.room.topic")]
+    | Annotated[PowerLevelsEvent, Tag("m.room.power_levels")]
+    | Annotated[SpaceChildEvent, Tag("m.space.child")]
+    | Annotated[MessageEvent, Tag("m.room.message")]
+    | Annotated[ReactionEvent, Tag("m.reaction")]
+    | Annotated[RedactionEvent, Tag("m.room.redaction")]
+    | Annotated[SkippedEvent, Tag("__skipped__")]
+    | Annotated[GenericEvent, Tag("__default__")],
+    Discriminator(get_event_type),
+]
+
+
+class OldExportFile(BaseModel):
+    room_name: str
+    room_creator: str
+    topic: str
+    export_date: str
+    exported_by: str
+    messages: list[OldEvent]
+
+
+def bench(name: str, decode, raw: bytes, num_events: int, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(raw)
+        best = min(best, time.perf_counter() - start)
+    print(f"  {name:<40} {best:6.2f} s  {num_events / best:10.0f} events/s")
+
+
+def measure(num_events: int):
+    raw = synthetic_export_bytes(num_events)
+    print(f"{num_events} events, {len(raw) / 2**20:.1f} MiB")
+    bench(
+        "callable discriminator + json.loads",
+        lambda raw: OldExportFile.model_validate(json.loads(raw)),
+        raw,
+        num_events,
+    )
+    bench(
+        "export_file_adapter.validate_json",
+        export_file_adapter.validate_json,
+        raw,
+        num_events,
+    )
+
+
+if __name__ == "__main__":
+    measure(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
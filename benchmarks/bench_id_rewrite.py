@@ -0,0 +1,80 @@
+import copy
+import sys
+import time
+from urllib.parse import quote
+
+from synthetic_export import USERS, synthetic_export
+
+from matrix_room_import.export_file_model import export_file_adapter
+from matrix_room_import.export_parser import compile_export
+from matrix_room_import.id_rewriter import IdRewriter
+from matrix_room_import.import_plan import ImportPlan
+
+SERVER_NAMES = {"example.com": "example.org"}
+USER_IDS = {user_id: user_id.replace("user", "member") for user_id in USERS[:10]}
+
+
+# One str.replace per mapped id and encoding, what rewriting without a
+# combined matcher amounts to.
+def naive_rewriter(plan: ImportPlan):
+    replacements = [
+        *(
+            (old, new.replace("example.com", "example.org"))
+            for old, new in USER_IDS.items()
+        ),
+        *(
+            (
+                quote(old, safe=""),
+                quote(new.replace("example.com", "example.org"), safe=""),
+            )
+            for old, new in USER_IDS.items()
+        ),
+        *((f":{old}", f":{new}") for old, new in SERVER_NAMES.items()),
+        *((f"%3A{old}", f"%3A{new}") for old, new in SERVER_NAMES.items()),
+    ]
+
+    def rewrite(value):
+        if isinstance(value, str):
+            for old, new in replacements:
+                value = value.replace(old, new)
+            return value
+        if isinstance(value, dict):
+            return {rewrite(k): rewrite(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [rewrite(v) for v in value]
+        return value
+
+    for operation in plan.operations():
+        if operation.user_id is not None:
+            operation.user_id = rewrite(operation.user_id)
+        if operation.state_key is not None:
+            operation.state_key = rewrite(operation.state_key)
+        if operation.content is not None:
+            operation.content = rewrite(operation.content)
+
+
+def bench(name: str, rewrite, plan: ImportPlan, repeat: int = 3):
+    best = float("inf")
+    num_operations = len(plan.timeline)
+    for _ in range(repeat):
+        copied = copy.deepcopy(plan)
+        start = time.perf_counter()
+        rewrite(copied)
+        best = min(best, time.perf_counter() - start)
+    print(f"  {name:<40} {best:6.2f} s  {num_operations / best:10.0f} operations/s")
+
+
+def measure(num_events: int):
+    data = export_file_adapter.validate_python(synthetic_export(num_events))
+    plan = compile_export(data, {}).plan
+    print(f"{num_events} events, {len(plan.timeline)} operations")
+    bench("str.replace per mapped id", naive_rewriter, plan)
+    bench(
+        "IdRewriter single pass",
+        IdRewriter(SERVER_NAMES, USER_IDS).rewrite_plan,
+        plan,
+    )
+
+
+if __name__ == "__main__":
+    measure(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,58 @@
+import gc
+import json
+import sys
+import tracemalloc
+
+from synthetic_export import synthetic_export_bytes
+
+from matrix_room_import.export_file_model import ExportFile
+from matrix_room_import.export_index import build_export_index
+from matrix_room_import.import_plan import compile_plan
+from matrix_room_import.replay_events import to_replay_events
+
+
+# Peak traced memory of compiling the plan of an export, on top of the
+# decoded export.
+def compile_peak(data: ExportFile, materialize: bool) -> int:
+    index = build_export_index(data)
+    gc.collect()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    events = to_replay_events(data.messages)
+    plan = compile_plan(
+        index.initial_state,
+        list(events) if materialize else events,
+        set(),
+        index.redacted_event_ids,
+        {},
+        index.mimetypes,
+    )
+    _, peak = tracemalloc.get_traced_memory()
+    del plan
+    return peak - base
+
+
+def measure(num_events: int):
+    raw = synthetic_export_bytes(num_events)
+
+    gc.collect()
+    tracemalloc.start()
+    data = ExportFile.model_validate(json.loads(raw))
+    _, decode_peak = tracemalloc.get_traced_memory()
+    gc.collect()
+    export_size, _ = tracemalloc.get_traced_memory()
+
+    list_peak = compile_peak(data, materialize=True)
+    stream_peak = compile_peak(data, materialize=False)
+    tracemalloc.stop()
+
+    print(f"{num_events} events")
+    print(f"  ExportFile:                {export_size / 2**20:8.1f} MiB")
+    print(f"  decode peak:               {decode_peak / 2**20:8.1f} MiB")
+    print(f"  compile peak, list:        {list_peak / 2**20:8.1f} MiB")
+    print(f"  compile peak, streamed:    {stream_peak / 2**20:8.1f} MiB")
+    print(f"  reduction:                 {100 * (1 - stream_peak / list_peak):8.1f} %")
+
+
+if __name__ == "__main__":
+    measure(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,79 @@
+import json
+import sys
+import time
+from pathlib import Path
+
+from synthetic_export import synthetic_export
+
+from matrix_room_import.appservice.server import filter_events
+from matrix_room_import.appservice.types import ClientEvents
+from matrix_room_import.concurrency_events import ServerStats
+from matrix_room_import.config import Config
+from matrix_room_import.db_migrations import execute_migrations
+from matrix_room_import.stores import get_bot_rooms_store
+
+DATABASE = Path(__file__).parent / "bench.db"
+
+
+# A transaction echoing the replay of an import, with a few messages of a bot
+# room among them, or none.
+def synthetic_transaction(num_events: int, bot_messages: bool = True) -> dict:
+    events = synthetic_export(num_events)["messages"]
+    if bot_messages:
+        for event in events[::100]:
+            event["room_id"] = "!bot:example.org"
+    return {"events": events}
+
+
+def bench(name: str, handle, body: bytes, num_events: int, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        handle(body)
+        best = min(best, time.perf_counter() - start)
+    print(f"  {name:<40} {best:6.3f} s  {num_events / best:10.0f} events/s")
+
+
+def measure(num_events: int):
+    DATABASE.unlink(missing_ok=True)
+    execute_migrations(DATABASE)
+    config = Config(
+        homeserver_url="http://localhost",
+        server_name="example.org",
+        hs_token="",
+        as_token="",
+        as_id="import",
+        as_localpart="import",
+        bot_displayname="",
+        path_to_import_files=Path(),
+        admin_token="",
+        port=0,
+        database_location=str(DATABASE),
+    )
+    get_bot_rooms_store(config).append("!bot:example.org")
+    body = json.dumps(synthetic_transaction(num_events)).encode()
+    print(f"{num_events} events")
+    bench(
+        "ClientEvents(**json.loads(body))",
+        lambda body: ClientEvents(**json.loads(body)),
+        body,
+        num_events,
+    )
+    bench(
+        "filter_events",
+        lambda body: filter_events(config, body, ServerStats()),
+        body,
+        num_events,
+    )
+    echoes = json.dumps(synthetic_transaction(num_events, False)).encode()
+    bench(
+        "filter_events, echoes only",
+        lambda body: filter_events(config, body, ServerStats()),
+        echoes,
+        num_events,
+    )
+    DATABASE.unlink()
+
+
+if __name__ == "__main__":
+    measure(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
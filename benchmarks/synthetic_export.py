@@ -0,0 +1,98 @@
+import json
+import random
+from typing import Any
+
+USERS = [f"@user{i}:example.com" for i in range(50)]
+
+
+def event(
+    i: int, type: str, sender: str, content: dict[str, Any], state_key: str | None
+) -> dict[str, Any]:
+    data: dict[str, Any] = {
+        "type": type,
+        "sender": sender,
+        "origin_server_ts": 1700000000000 + i,
+        "unsigned": {"age": 1000 + i, "transaction_id": f"m{i}"},
+        "event_id": f"$event{i}",
+        "room_id": "!room:example.com",
+        "content": content,
+    }
+    if state_key is not None:
+        data["state_key"] = state_key
+    return data
+
+
+def synthetic_export(num_events: int, seed: int = 0) -> dict[str, Any]:
+    rng = random.Random(seed)
+    creator = USERS[0]
+    messages = [
+        event(0, "m.room.create", creator, {"room_version": "10"}, ""),
+        event(
+            1,
+            "m.room.member",
+            creator,
+            {"membership": "join", "displayname": "user0"},
+            creator,
+        ),
+        event(2, "m.room.join_rules", creator, {"join_rule": "public"}, ""),
+    ]
+    for i in range(3, num_events):
+        sender = rng.choice(USERS)
+        mention = rng.choice(USERS)
+        if rng.random() < 0.05:
+            messages.append(
+                event(
+                    i,
+                    "m.room.member",
+                    sender,
+                    {"membership": "join", "displayname": sender[1:7]},
+                    sender,
+                )
+            )
+        elif i > 3 and rng.random() < 0.1:
+            messages.append(
+                event(
+                    i,
+                    "m.reaction",
+                    sender,
+                    {
+                        "m.relates_to": {
+                            "rel_type": "m.annotation",
+                            "event_id": f"$event{rng.randrange(3, i)}",
+                            "key": "👍",
+                        }
+                    },
+                    None,
+                )
+            )
+        else:
+            messages.append(
+                event(
+                    i,
+                    "m.room.message",
+                    sender,
+                    {
+                        "msgtype": "m.text",
+                        "body": f"{mention}: message number {i} " + "lorem " * 10,
+                        "format": "org.matrix.custom.html",
+                        "formatted_body": (
+                            f'<a href="https://matrix.to/#/{mention}">{mention}</a>'
+                            f": message number {i}"
+                        ),
+                        "m.mentions": {"user_ids": [mention]},
+                    },
+                    None,
+                )
+            )
+    return {
+        "room_name": "Synthetic room",
+        "room_creator": "user0",
+        "topic": "",
+        "export_date": "2024-01-01",
+        "exported_by": creator,
+        "messages": messages,
+    }
+
+
+def synthetic_export_bytes(num_events: int, seed: int = 0) -> bytes:
+    return json.dumps(synthetic_export(num_events, seed)).encode()
@@ -1,10 +1,12 @@
-from collections.abc import Mapping, Sequence
+from collections.abc import AsyncIterable, AsyncIterator, Mapping, Sequence
+from contextlib import asynccontextmanager
 from enum import Enum
 from pathlib import Path
 from typing import Any, Literal
 from uuid import uuid4
 
-from aiohttp import ClientResponse, ClientSession
+from aiohttp import ClientError, ClientResponse, ClientSession, ClientTimeout
+from aiohttp.client import DEFAULT_TIMEOUT
 
 from matrix_room_import import LOGGER, matrix_api
 from matrix_room_import.appservice.types import (
@@ -15,6 +17,7 @@ from matrix_room_import.appservice.types import (
     DeleteRoomBody,
     DeleteRoomResponse,
     ErrorResponse,
+    EventContextResponse,
     InviteToRoomBody,
     InviteToRoomResponse,
     JoinRoomBody,
@@ -34,6 +37,13 @@ from matrix_room_import.appservice.types import (
     WhoAmIResponse,
 )
 
+# Media can take longer than the default total timeout of 5 minutes to
+# transfer, its requests only time out when the connection stalls.
+MEDIA_TIMEOUT = ClientTimeout(total=None, sock_connect=30, sock_read=300)
+
+# Errors of requests that got no response from the homeserver.
+REQUEST_ERRORS = (ClientError, TimeoutError)
+
 
 def new_txn() -> str:
     return str(uuid4())
@@ -66,8 +76,9 @@ class Client:
         method: HTTPMethod,
         body: Any = None,
         headers: Mapping[str, str] | None = None,
-        data: bytes | None = None,
+        data: bytes | AsyncIterable[bytes] | None = None,
         raw: bool = False,
+        timeout: ClientTimeout = DEFAULT_TIMEOUT,
     ) -> tuple[ClientResponse, Any]:
         if body is None:
             body = {}
@@ -75,7 +86,7 @@ class Client:
             headers = self.headers
         if data is not None:
             body = None
-        async with ClientSession(headers=headers) as session:
+        async with ClientSession(headers=headers, timeout=timeout) as session:
             async with session.request(
                 method.value, url, data=data, json=body
             ) as response:
@@ -117,6 +128,17 @@ class Client:
             return WhoAmIResponse(**data)
         return ErrorResponse(**data, statuscode=response.status)
 
+    # Identifies the owner of a user access token, e.g. of a direct upload.
+    async def user_whoami(self, access_token: str) -> WhoAmIResponse | ErrorResponse:
+        url = matrix_api.user_whoami(self.hs_url)
+        LOGGER.info("CLIENT user_whoami")
+        response, data = await self.request(
+            url, HTTPMethod.get, headers={"Authorization": f"Bearer {access_token}"}
+        )
+        if response.status == 200:
+            return WhoAmIResponse(**data)
+        return ErrorResponse(**data, statuscode=response.status)
+
     async def profile(self, user_id: str) -> ProfileResponse | ErrorResponse:
         url = matrix_api.profile(self.hs_url, user_id)
         LOGGER.info("CLIENT profile")
@@ -190,13 +212,16 @@ class Client:
         return ErrorResponse(**data, statuscode=response.status)
 
     async def create_room(
-        self, body: CreateRoomBody, user_id: str | None = None, ts: int | None = None
+        self,
+        body: CreateRoomBody | Mapping[str, Any],
+        user_id: str | None = None,
+        ts: int | None = None,
     ) -> CreateRoomResponse | ErrorResponse:
         url = matrix_api.create_room(self.hs_url, user_id, ts)
         LOGGER.info("CLIENT create_room")
-        response, data = await self.request(
-            url, HTTPMethod.post, body.model_dump(by_alias=True, exclude_defaults=True)
-        )
+        if isinstance(body, CreateRoomBody):
+            body = body.model_dump(by_alias=True, exclude_defaults=True)
+        response, data = await self.request(url, HTTPMethod.post, body)
         if response.status == 200:
             resp = CreateRoomResponse(**data)
             LOGGER.debug(resp.room_id)
@@ -230,7 +255,7 @@ class Client:
         self,
         event_type: str,
         room_id: str,
-        room_message: RoomMessage,
+        room_message: RoomMessage | Mapping[str, Any],
         txn_id: str | None = None,
         user_id: str | None = None,
         ts: int | None = None,
@@ -240,11 +265,9 @@ class Client:
             self.hs_url, room_id, event_type, txn_id, user_id, ts
         )
         LOGGER.info("CLIENT send_event")
-        response, data = await self.request(
-            url,
-            HTTPMethod.put,
-            room_message.model_dump(by_alias=True, exclude_defaults=True),
-        )
+        if isinstance(room_message, RoomMessage):
+            room_message = room_message.model_dump(by_alias=True, exclude_defaults=True)
+        response, data = await self.request(url, HTTPMethod.put, room_message)
 
         if response.status == 200:
             data = RoomSendEventResponse(**data)
@@ -309,17 +332,22 @@ class Client:
         self,
         server_name: str,
         media_id: str,
-        content: bytes,
+        content: bytes | AsyncIterable[bytes],
         filename: str | None = None,
         content_type: str | None = None,
+        content_length: int | None = None,
     ) -> UploadMediaResponse | ErrorResponse:
         url = matrix_api.upload_media(self.hs_url, server_name, media_id, filename)
         LOGGER.info("CLIENT upload_media")
         if content_type is None:
             content_type = "application/octet-stream"
         headers = {**self.headers, "Content-Type": content_type}
+        # streamed content is sent with the length announced by its source,
+        # homeservers refuse chunked uploads.
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
         response, data = await self.request(
-            url, HTTPMethod.put, headers=headers, data=content
+            url, HTTPMethod.put, headers=headers, data=content, timeout=MEDIA_TIMEOUT
         )
 
         if response.status == 200:
@@ -362,7 +390,9 @@ class Client:
             self.hs_url, server_name, media_id, allow_redirect, allow_remote, timeout_ms
         )
         LOGGER.info("CLIENT download media")
-        response, data = await self.request(url, HTTPMethod.get, raw=True)
+        response, data = await self.request(
+            url, HTTPMethod.get, raw=True, timeout=MEDIA_TIMEOUT
+        )
 
         if response.status == 200:
             with open(download_path, "wb") as f:
@@ -375,6 +405,26 @@ class Client:
         )
         return data
 
+    # The response body is read by the caller, e.g. to stream it into
+    # `upload_media` of another client. A download interrupted at `offset` is
+    # resumed with a range request, answered with a 206 when supported.
+    @asynccontextmanager
+    async def stream_media(
+        self, media_url: str, allow_remote: bool = True, offset: int = 0
+    ) -> AsyncIterator[ClientResponse]:
+        server_name, _, media_id = media_url[6:].partition("/")
+        url = matrix_api.download_media(
+            self.hs_url, server_name, media_id, allow_remote=allow_remote
+        )
+        LOGGER.info("CLIENT stream media")
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else None
+        # large media take longer than the default total timeout.
+        async with (
+            ClientSession(headers=self.headers, timeout=MEDIA_TIMEOUT) as session,
+            session.get(url, headers=headers) as response,
+        ):
+            yield response
+
     async def get_room_state(
         self, room_id: str, user_id: str | None = None
     ) -> ArrayOfClientEvents | ErrorResponse:
@@ -393,6 +443,30 @@ class Client:
         )
         return data
 
+    async def get_event_context(
+        self,
+        room_id: str,
+        event_id: str,
+        limit: int | None = None,
+        user_id: str | None = None,
+    ) -> EventContextResponse | ErrorResponse:
+        url = matrix_api.get_event_context(
+            self.hs_url, room_id, event_id, limit, user_id
+        )
+        LOGGER.info("CLIENT get event context")
+        response, data = await self.request(url, HTTPMethod.get)
+
+        if response.status == 200:
+            data = EventContextResponse(**data)
+            LOGGER.debug(data)
+            return data
+        data = ErrorResponse(**await response.json(), statuscode=response.status)
+        LOGGER.debug(
+            "CLIENT get event context error data: %s",
+            {"headers": response.headers, "body": data},
+        )
+        return data
+
     async def get_room_messages(
         self,
         room_id: str,
@@ -0,0 +1,120 @@
+import asyncio
+
+from aiohttp import ClientError
+
+from matrix_room_import import LOGGER
+from matrix_room_import.appservice.client import REQUEST_ERRORS, Client
+from matrix_room_import.appservice.server import queue_export, send_thread_message
+from matrix_room_import.concurrency_events import SyncTaskSems
+from matrix_room_import.config import Config
+from matrix_room_import.stores import Download, get_downloads_store
+
+
+def part_path(download: Download):
+    return download.path.with_name(download.path.name + ".part")
+
+
+# Downloads into a .part file, resuming it with range requests after a
+# dropped connection, here or in a previous run.
+async def download_export(client: Client, config: Config, download: Download) -> bool:
+    path = part_path(download)
+    for attempt in range(config.download_retries + 1):
+        offset = path.stat().st_size if path.exists() else 0
+        try:
+            async with client.stream_media(
+                download.url, allow_remote=False, offset=offset
+            ) as response:
+                if response.status == 416 and offset > 0:
+                    # the previous attempt got every byte.
+                    return True
+                if response.status not in (200, 206):
+                    LOGGER.error(
+                        "Could not download %s: %s",
+                        download.url,
+                        await response.text(),
+                    )
+                    if response.status < 500 and response.status != 429:
+                        return False
+                    raise ClientError(f"status {response.status}")
+                # a 200 ignores the range, the download starts over.
+                mode = "ab" if response.status == 206 else "wb"
+                f = await asyncio.to_thread(open, path, mode)
+                try:
+                    async for chunk in response.content.iter_chunked(1 << 20):
+                        await asyncio.to_thread(f.write, chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+            return True
+        except REQUEST_ERRORS as e:
+            LOGGER.warning(
+                "Download of %s interrupted (attempt %d): %s",
+                download.url,
+                attempt + 1,
+                e,
+            )
+            await asyncio.sleep(min(2**attempt, 60))
+    return False
+
+
+async def finish_download(
+    client: Client, config: Config, sync_tasks_sem: SyncTaskSems, k: int
+):
+    downloads_store = get_downloads_store(config)
+    download = downloads_store[k]
+    bot_userid = f"@{config.as_id}:{config.server_name}"
+    try:
+        downloaded = await download_export(client, config, download)
+    except OSError:
+        LOGGER.exception("Could not download %s", download.url)
+        downloaded = False
+    downloads_store.pop(k)
+    if not downloaded:
+        part_path(download).unlink(missing_ok=True)
+        await send_thread_message(
+            client,
+            download.room_id,
+            download.event_id,
+            "Could not download the export, please send it again.",
+            bot_userid,
+        )
+        return
+    part_path(download).rename(download.path)
+    if await queue_export(
+        config,
+        client,
+        download.room_id,
+        download.event_id,
+        download.path,
+        sync_tasks_sem,
+    ):
+        await send_thread_message(
+            client,
+            download.room_id,
+            download.event_id,
+            "Downloaded. Adding to queue.",
+            bot_userid,
+        )
+
+
+# Exports sent in bot rooms are downloaded in the background, a few at a time,
+# and handed to the import queue once complete.
+async def download_task_runner(
+    client: Client, config: Config, sync_tasks_sem: SyncTaskSems
+):
+    for k in get_downloads_store(config).data:
+        sync_tasks_sem.pending_downloads.put_nowait(k)
+    sem = asyncio.Semaphore(config.download_concurrency)
+    tasks: set[asyncio.Task] = set()
+
+    async def run(k: int):
+        try:
+            await finish_download(client, config, sync_tasks_sem, k)
+        finally:
+            sem.release()
+
+    while True:
+        k = await sync_tasks_sem.pending_downloads.get()
+        await sem.acquire()
+        task = asyncio.create_task(run(k))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
@@ -1,10 +1,15 @@
+import asyncio
+import json
 from collections.abc import Sequence
+from dataclasses import asdict
+from pathlib import Path
+from uuid import uuid4
 
 from aiohttp import web
 
 import matrix_room_import.appservice.types as types
 from matrix_room_import import LOGGER, PROJECT_DIR
-from matrix_room_import.appkeys import client_key, config_key, sync_sem_key
+from matrix_room_import.appkeys import client_key, config_key, stats_key, sync_sem_key
 from matrix_room_import.appservice.client import Client
 from matrix_room_import.appservice.types import (
     ClientEvent,
@@ -17,18 +22,32 @@ from matrix_room_import.appservice.types import (
     RoomMember,
     RoomMessage,
 )
-from matrix_room_import.concurrency_events import SyncTaskSems
+from matrix_room_import.concurrency_events import (
+    ServerStats,
+    SyncTaskSems,
+)
 from matrix_room_import.config import Config
 from matrix_room_import.export_file_model import MemberContent
+from matrix_room_import.export_parser import export_sha256
 from matrix_room_import.stores import (
+    Download,
+    ImportRecord,
+    ImportStatus,
     Process,
+    QueueStore,
     get_bot_rooms_store,
     get_config_store,
+    get_downloads_store,
+    get_imports_store,
     get_queue_store,
     get_rooms_to_remove_store,
     get_txn_store,
 )
 
+# Exports received by the bot, downloaded from the media repository or uploaded
+# straight to the appservice.
+SPOOL_DIR = PROJECT_DIR / "data"
+
 
 def check_headers(request: web.Request, hs_token: str) -> bool:
     return (
@@ -49,28 +68,96 @@ async def handle_ping(request: web.Request) -> web.Response:
     return web.json_response({}, status=200)
 
 
+async def handle_event(
+    client: Client,
+    config: Config,
+    event: ClientEvent,
+    txn_id: str,
+    sync_tasks_sem: SyncTaskSems,
+):
+    LOGGER.debug(f"Transaction {txn_id} type= {event.type}")
+    LOGGER.debug("%s", event)
+
+    match event.type:
+        case "m.room.member":
+            content = RoomMember(**event.content)
+            await handle_room_member(config, client, event, content)
+        case "m.room.message" if get_bot_rooms_store(config).has(event.room_id):
+            content = RoomMessage(**event.content)
+            await handle_room_message(config, client, event, content, sync_tasks_sem)
+
+
+# Events of a room are handled in order, in a lane of their own, while the
+# lanes of different rooms run concurrently.
 async def handle_events(
     client: Client,
     config: Config,
     events: Sequence[ClientEvent],
     txn_id: str,
     sync_tasks_sem: SyncTaskSems,
+    stats: ServerStats,
 ):
-    bot_rooms_store = get_bot_rooms_store(config)
-
+    lanes: dict[str, list[ClientEvent]] = {}
     for event in events:
-        LOGGER.debug(f"Transaction {txn_id} type= {event.type}")
-        LOGGER.debug("%s", event)
-
-        match event.type:
-            case "m.room.member":
-                content = RoomMember(**event.content)
-                await handle_room_member(config, client, event, content)
-            case "m.room.message" if bot_rooms_store.has(event.room_id):
-                content = RoomMessage(**event.content)
-                await handle_room_message(
-                    config, client, event, content, sync_tasks_sem
-                )
+        lanes.setdefault(event.room_id, []).append(event)
+    sem = asyncio.Semaphore(config.room_lane_concurrency)
+
+    async def run_lane(room_id: str, lane: list[ClientEvent]):
+        depths = stats.lane_depths
+        depths[room_id] = depths.get(room_id, 0) + len(lane)
+        stats.max_lane_depth = max(stats.max_lane_depth, depths[room_id])
+        remaining = len(lane)
+        try:
+            async with sem:
+                for event in lane:
+                    await handle_event(client, config, event, txn_id, sync_tasks_sem)
+                    stats.events_handled += 1
+                    remaining -= 1
+                    depths[room_id] -= 1
+        finally:
+            # events left after a failure are not handled.
+            depths[room_id] -= remaining
+            if depths[room_id] <= 0:
+                del depths[room_id]
+
+    results = await asyncio.gather(
+        *(run_lane(room_id, lane) for room_id, lane in lanes.items()),
+        return_exceptions=True,
+    )
+    # the transaction fails, and is retried by the homeserver, once every
+    # other lane is done.
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+# The appservice receives every event of its namespace. Events are picked on
+# their raw JSON, only the events `handle_event` acts upon are validated: the
+# echoes of the bot messages are dropped and counted apart, the replay of
+# imports is neither in a bot room nor aimed at the bot and is filtered out.
+def filter_events(config: Config, body: bytes, stats: ServerStats) -> list[ClientEvent]:
+    bot_userid = f"@{config.as_id}:{config.server_name}"
+    bot_rooms = set(get_bot_rooms_store(config).data.values())
+    data = json.loads(body)
+    if not isinstance(data, dict) or not isinstance(data.get("events", []), list):
+        raise ValueError("Transaction events are not a list")
+    raw_events = data.get("events", [])
+    events: list[ClientEvent] = []
+    echoes = 0
+    for raw_event in raw_events:
+        if not isinstance(raw_event, dict):
+            continue
+        event_type = raw_event.get("type")
+        if event_type == "m.room.message" and raw_event.get("sender") == bot_userid:
+            echoes += 1
+        elif (
+            event_type == "m.room.member" and raw_event.get("state_key") == bot_userid
+        ) or (event_type == "m.room.message" and raw_event.get("room_id") in bot_rooms):
+            events.append(ClientEvent.model_validate(raw_event))
+    stats.events_received += len(raw_events)
+    stats.echoes_suppressed += echoes
+    stats.events_filtered += len(raw_events) - len(events) - echoes
+    return events
 
 
 async def handle_transaction(request: web.Request) -> web.Response:
@@ -89,13 +176,27 @@ async def handle_transaction(request: web.Request) -> web.Response:
         LOGGER.debug("Transaction already handled.")
         return web.json_response({}, status=200)
 
-    data = await request.json()
-    events = types.ClientEvents(**data)
-    await handle_events(client, config, events.events, txn_id, sync_tasks_sem)
+    stats = request.app[stats_key]
+    try:
+        events = filter_events(config, await request.read(), stats)
+    # invalid JSON, or a picked event that does not validate.
+    except ValueError:
+        LOGGER.exception("Invalid transaction %s", txn_id)
+        return web.json_response(
+            {"errcode": "M_BAD_JSON", "error": "Invalid transaction"}, status=400
+        )
+    await handle_events(client, config, events, txn_id, sync_tasks_sem, stats)
 
     return web.json_response({}, status=200)
 
 
+async def handle_stats(request: web.Request) -> web.Response:
+    config = request.app[config_key]
+    if not check_headers(request, config.hs_token):
+        return web.json_response({}, status=403)
+    return web.json_response(asdict(request.app[stats_key]))
+
+
 async def send_help_message(config: Config, client: Client, room_id: str, user_id: str):
     current_space_link = (
         "null" if config.space_id is None else f"https://matrix.to/#/{config.space_id}"
@@ -164,6 +265,79 @@ async def handle_room_member(
         LOGGER.debug(resp)
 
 
+async def send_thread_message(
+    client: Client, room_id: str, thread_id: str, body: str, bot_userid: str
+):
+    await client.send_event(
+        "m.room.message",
+        room_id,
+        RoomMessage(
+            msgtype=MsgType.text,
+            body=body,
+            relates_to=RelatesTo(
+                rel_type="m.thread", event_id=thread_id, is_falling_back=True
+            ),
+        ),
+        user_id=bot_userid,
+    )
+
+
+async def send_duplicate_import_message(
+    client: Client,
+    room_id: str,
+    thread_id: str,
+    previous_import: ImportRecord,
+    queue_store: QueueStore,
+    bot_userid: str,
+):
+    if previous_import.status == ImportStatus.done:
+        body = (
+            "This export was already imported: "
+            f"https://matrix.to/#/{previous_import.new_room_id}"
+        )
+    else:
+        position = queue_store.position(previous_import.event_id)
+        if position is None:
+            body = "This export is already being imported."
+        else:
+            body = f"This export is already in the queue (position {position})."
+    await send_thread_message(client, room_id, thread_id, body, bot_userid)
+
+
+# Queues an export received in a bot room thread, unless it was already
+# imported. Returns whether it was queued.
+async def queue_export(
+    config: Config,
+    client: Client,
+    room_id: str,
+    thread_id: str,
+    path: Path,
+    concurrency: SyncTaskSems,
+) -> bool:
+    queue_store = get_queue_store(config)
+    imports_store = get_imports_store(config)
+    bot_userid = f"@{config.as_id}:{config.server_name}"
+    sha256 = await asyncio.to_thread(export_sha256, path)
+    previous_import = imports_store.from_sha256(sha256)
+    if previous_import is not None:
+        await send_duplicate_import_message(
+            client, room_id, thread_id, previous_import, queue_store, bot_userid
+        )
+        return False
+
+    queue_store.append(Process(path=path, room_id=room_id, event_id=thread_id))
+    imports_store.append(
+        ImportRecord(
+            sha256=sha256,
+            status=ImportStatus.pending,
+            event_id=thread_id,
+            room_id=room_id,
+        )
+    )
+    concurrency.num_export_process_sem.release()
+    return True
+
+
 async def handle_room_message(
     config: Config,
     client: Client,
@@ -172,7 +346,6 @@ async def handle_room_message(
     concurrency: SyncTaskSems,
 ):
     rooms_to_remove = get_rooms_to_remove_store(config)
-    queue_store = get_queue_store(config)
     bot_userid = f"@{config.as_id}:{config.server_name}"
     if event.sender == bot_userid or event.sender not in config.bot_allow_users:
         return
@@ -187,7 +360,7 @@ async def handle_room_message(
             reason="Security",
             user_id=bot_userid,
         )
-        resp = await client.send_event(
+        await client.send_event(
             "m.room.message",
             event.room_id,
             RoomMessage(
@@ -207,7 +380,7 @@ async def handle_room_message(
         if space_id.lower() == "null":
             space_id = None
         config.space_id = space_id
-        resp = await client.send_event(
+        await client.send_event(
             "m.room.message",
             event.room_id,
             RoomMessage(
@@ -229,7 +402,7 @@ async def handle_room_message(
         print("Deleting room")
         room_event = rooms_to_remove.pop_from_event(relates_to["event_id"])
         for user in room_event.users:
-            resp = await client.send_state_event(
+            await client.send_state_event(
                 "m.room.member",
                 room_event.room_id,
                 MemberContent(membership="leave").model_dump(
@@ -240,7 +413,7 @@ async def handle_room_message(
             )
         await client.delete_room(room_event.room_id, DeleteRoomBody(purge=True))
 
-        resp = await client.send_event(
+        await client.send_event(
             "m.room.message",
             event.room_id,
             RoomMessage(
@@ -259,9 +432,10 @@ async def handle_room_message(
     if content.msgtype == MsgType.file and content.url is not None:
         print("Received message")
         print(event)
-        download_path = PROJECT_DIR / "data" / content.body
+        # exports sent with the same name do not share their file.
+        download_path = SPOOL_DIR / f"{uuid4().hex}-{Path(content.body).name}"
 
-        resp = await client.send_event(
+        await client.send_event(
             "m.room.message",
             event.room_id,
             RoomMessage(
@@ -274,31 +448,14 @@ async def handle_room_message(
             user_id=bot_userid,
         )
 
-        resp = await client.download_media(
-            download_path, content.url, allow_redirect=False
-        )
-        if isinstance(resp, bool) and resp:
-            queue_store.append(
-                Process(
-                    path=download_path,
-                    room_id=event.room_id,
-                    event_id=event.event_id,
-                )
-            )
-
-            resp = await client.send_event(
-                "m.room.message",
-                event.room_id,
-                RoomMessage(
-                    msgtype=MsgType.text,
-                    body="Downloaded. Adding to queue.",
-                    relates_to=RelatesTo(
-                        rel_type="m.thread",
-                        event_id=event.event_id,
-                        is_falling_back=True,
-                    ),
-                ),
-                user_id=bot_userid,
+        SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+        k = get_downloads_store(config).append(
+            Download(
+                url=content.url,
+                path=download_path,
+                room_id=event.room_id,
+                event_id=event.event_id,
             )
-            concurrency.num_export_process_sem.release()
+        )
+        concurrency.pending_downloads.put_nowait(k)
         return
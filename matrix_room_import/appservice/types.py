@@ -116,6 +116,9 @@ class RoomMessage(BaseModel):
     relates_to: RelatesTo | None = Field(
         serialization_alias="m.relates_to", default=None
     )
+    new_content: Mapping[str, Any] | None = Field(
+        serialization_alias="m.new_content", default=None
+    )
 
     file: str | None = None
     filename: str | None = None
@@ -228,6 +231,15 @@ class RoomMessagesResponse(BaseModel):
     state: Sequence[ClientEvent] = Field(default_factory=list)
 
 
+class EventContextResponse(BaseModel):
+    end: str | None = None
+    event: ClientEvent | None = None
+    events_after: Sequence[ClientEvent] = Field(default_factory=list)
+    events_before: Sequence[ClientEvent] = Field(default_factory=list)
+    start: str | None = None
+    state: Sequence[ClientEvent] = Field(default_factory=list)
+
+
 class RoomEventFilter(BaseModel):
     contains_url: bool | None = None
     include_redundant_members: bool | None = None
@@ -0,0 +1,202 @@
+import asyncio
+from pathlib import Path
+from uuid import uuid4
+
+from aiohttp import web
+
+from matrix_room_import import LOGGER
+from matrix_room_import.appkeys import client_key, config_key, sync_sem_key
+from matrix_room_import.appservice.server import (
+    SPOOL_DIR,
+    queue_export,
+    send_thread_message,
+)
+from matrix_room_import.appservice.types import (
+    MsgType,
+    RoomMessage,
+    RoomSendEventResponse,
+    WhoAmIResponse,
+)
+from matrix_room_import.export_parser import is_export
+from matrix_room_import.stores import Upload, get_bot_rooms_store, get_uploads_store
+
+# Exports are uploaded straight to the appservice instead of going through the
+# media repository: an upload is created in a bot room, which starts its
+# thread, then its bytes are sent with PATCH requests carrying the offset they
+# start at. An interrupted upload is resumed from the offset returned by HEAD.
+UPLOADS_PATH = "/_matrix_room_import/v1/uploads"
+
+# uploads receiving bytes, a second PATCH of the same upload is refused.
+active_uploads: set[str] = set()
+
+
+def error_response(status: int, errcode: str, error: str) -> web.Response:
+    return web.json_response({"errcode": errcode, "error": error}, status=status)
+
+
+def part_path(upload: Upload) -> Path:
+    return upload.path.with_name(upload.path.name + ".part")
+
+
+def upload_offset(upload: Upload) -> int:
+    path = part_path(upload)
+    return path.stat().st_size if path.exists() else 0
+
+
+# Uploads are made with the access token of an allowed user.
+async def authenticate(request: web.Request) -> str | web.Response:
+    config = request.app[config_key]
+    client = request.app[client_key]
+    authorization = request.headers.get("Authorization", "")
+    if not authorization.startswith("Bearer "):
+        return error_response(401, "M_MISSING_TOKEN", "Missing access token")
+    resp = await client.user_whoami(authorization[7:])
+    if not isinstance(resp, WhoAmIResponse):
+        return error_response(401, "M_UNKNOWN_TOKEN", "Unknown access token")
+    if resp.user_id not in config.bot_allow_users:
+        return error_response(403, "M_FORBIDDEN", "User is not allowed to import")
+    return resp.user_id
+
+
+async def find_upload(request: web.Request) -> tuple[int, Upload] | web.Response:
+    user_id = await authenticate(request)
+    if isinstance(user_id, web.Response):
+        return user_id
+    found = get_uploads_store(request.app[config_key]).from_upload_id(
+        request.match_info["uploadId"]
+    )
+    if found is None or found[1].user_id != user_id:
+        return error_response(404, "M_NOT_FOUND", "Unknown upload")
+    return found
+
+
+async def handle_upload_create(request: web.Request) -> web.Response:
+    config = request.app[config_key]
+    client = request.app[client_key]
+    user_id = await authenticate(request)
+    if isinstance(user_id, web.Response):
+        return user_id
+
+    body = await request.json()
+    room_id = body.get("room_id")
+    filename = Path(str(body.get("filename", ""))).name
+    size = body.get("size")
+    if not isinstance(size, int) or size <= 0:
+        return error_response(400, "M_INVALID_PARAM", "size must be positive")
+    if not is_export(Path(filename)):
+        return error_response(400, "M_INVALID_PARAM", f"{filename} is not an export")
+    if not isinstance(room_id, str) or not get_bot_rooms_store(config).has(room_id):
+        return error_response(400, "M_INVALID_PARAM", "room_id is not a bot room")
+
+    bot_userid = f"@{config.as_id}:{config.server_name}"
+    resp = await client.send_event(
+        "m.room.message",
+        room_id,
+        RoomMessage(
+            msgtype=MsgType.text,
+            body=f"Receiving {filename} ({size} bytes) uploaded by {user_id}...",
+        ),
+        user_id=bot_userid,
+    )
+    if not isinstance(resp, RoomSendEventResponse):
+        LOGGER.error("Could not start the thread of an upload: %s", resp)
+        return error_response(502, "M_UNKNOWN", "Could not message the bot room")
+
+    upload_id = uuid4().hex
+    upload = Upload(
+        upload_id=upload_id,
+        path=SPOOL_DIR / f"{upload_id}-{filename}",
+        size=size,
+        user_id=user_id,
+        room_id=room_id,
+        event_id=resp.event_id,
+    )
+    SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    part_path(upload).touch()
+    get_uploads_store(config).append(upload)
+    return web.json_response(
+        {"upload_id": upload_id, "offset": 0, "event_id": resp.event_id},
+        status=201,
+        headers={"Location": f"{UPLOADS_PATH}/{upload_id}"},
+    )
+
+
+async def handle_upload_head(request: web.Request) -> web.Response:
+    found = await find_upload(request)
+    if isinstance(found, web.Response):
+        return found
+    _, upload = found
+    return web.Response(
+        headers={
+            "Upload-Offset": str(upload_offset(upload)),
+            "Upload-Length": str(upload.size),
+        }
+    )
+
+
+async def handle_upload_patch(request: web.Request) -> web.Response:
+    config = request.app[config_key]
+    client = request.app[client_key]
+    found = await find_upload(request)
+    if isinstance(found, web.Response):
+        return found
+    k, upload = found
+    if upload.upload_id in active_uploads:
+        return error_response(409, "M_UNKNOWN", "Upload already in progress")
+
+    offset = upload_offset(upload)
+    headers = {"Upload-Offset": str(offset)}
+    if request.headers.get("Upload-Offset") != str(offset):
+        return web.json_response(
+            {"errcode": "M_UNKNOWN", "error": "Wrong offset"},
+            status=409,
+            headers=headers,
+        )
+    if offset + (request.content_length or 0) > upload.size:
+        return error_response(413, "M_TOO_LARGE", "Upload is larger than its size")
+
+    # bytes received before a dropped connection are kept, the upload resumes
+    # from there.
+    active_uploads.add(upload.upload_id)
+    try:
+        f = await asyncio.to_thread(open, part_path(upload), "ab")
+        try:
+            async for chunk in request.content.iter_chunked(1 << 20):
+                chunk = chunk[: upload.size - offset]
+                await asyncio.to_thread(f.write, chunk)
+                offset += len(chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+    finally:
+        active_uploads.discard(upload.upload_id)
+    headers["Upload-Offset"] = str(offset)
+    if offset < upload.size:
+        return web.Response(status=204, headers=headers)
+
+    get_uploads_store(config).pop(k)
+    part_path(upload).rename(upload.path)
+    bot_userid = f"@{config.as_id}:{config.server_name}"
+    if await queue_export(
+        config,
+        client,
+        upload.room_id,
+        upload.event_id,
+        upload.path,
+        request.app[sync_sem_key],
+    ):
+        await send_thread_message(
+            client,
+            upload.room_id,
+            upload.event_id,
+            "Received. Adding to queue.",
+            bot_userid,
+        )
+    return web.Response(status=204, headers=headers)
+
+
+def upload_routes() -> list[web.RouteDef]:
+    return [
+        web.post(UPLOADS_PATH, handle_upload_create),
+        web.head(f"{UPLOADS_PATH}/{{uploadId}}", handle_upload_head),
+        web.patch(f"{UPLOADS_PATH}/{{uploadId}}", handle_upload_patch),
+    ]
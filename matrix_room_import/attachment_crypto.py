@@ -0,0 +1,53 @@
+import base64
+import hashlib
+from typing import Any
+
+from matrix_room_import.appservice.types import EncryptedFile
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    HAS_CRYPTO = True
+except ImportError:
+    HAS_CRYPTO = False
+
+
+def has_attachment_crypto() -> bool:
+    return HAS_CRYPTO
+
+
+def unpadded_b64decode(value: str) -> bytes:
+    value = value.replace("-", "+").replace("_", "/")
+    return base64.b64decode(value + "=" * (-len(value) % 4))
+
+
+# Decrypts an attachment of an encrypted room chunk by chunk (AES-CTR with the
+# key and iv of its EncryptedFile), hashing the ciphertext on the way.
+class AttachmentDecryptor:
+    def __init__(self, file: EncryptedFile):
+        if not HAS_CRYPTO:
+            raise ValueError("cryptography is not installed")
+        if file.key.alg != "A256CTR" or file.key.kty != "oct":
+            raise ValueError(f"Unsupported key algorithm {file.key.alg}")
+        if "sha256" not in file.hashes:
+            raise ValueError("No sha256 hash for the attachment")
+        key = unpadded_b64decode(file.key.k)
+        iv = unpadded_b64decode(file.iv)
+        if len(key) != 32 or len(iv) != 16:
+            raise ValueError("Invalid key or iv length")
+        self.expected_sha256 = unpadded_b64decode(file.hashes["sha256"])
+        self.sha256 = hashlib.sha256()
+        self.decryptor = Cipher(algorithms.AES(key), modes.CTR(iv)).decryptor()
+
+    @classmethod
+    def from_content(cls, file: Any) -> "AttachmentDecryptor":
+        return cls(EncryptedFile.model_validate(file))
+
+    def update(self, chunk: bytes) -> bytes:
+        self.sha256.update(chunk)
+        return self.decryptor.update(chunk)
+
+    def verify(self):
+        self.decryptor.finalize()
+        if self.sha256.digest() != self.expected_sha256:
+            raise ValueError("sha256 of the attachment does not match")
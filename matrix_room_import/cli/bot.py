@@ -1,51 +1,67 @@
 import asyncio
-import json
-from pathlib import Path
-from zipfile import ZipFile
+import multiprocessing
+from collections.abc import AsyncIterable, AsyncIterator, Collection, Iterable
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any
 
 import click
 from aiohttp import web
 from aiohttp.web import Application
 
 from matrix_room_import import LOGGER, PROJECT_DIR
-from matrix_room_import.appkeys import client_key, config_key, sync_sem_key
+from matrix_room_import.appkeys import client_key, config_key, stats_key, sync_sem_key
 from matrix_room_import.appservice import server
-from matrix_room_import.appservice.client import Client
+from matrix_room_import.appservice.client import REQUEST_ERRORS, Client, new_txn
+from matrix_room_import.appservice.downloads import download_task_runner
 from matrix_room_import.appservice.types import (
-    ClientEvent,
     CreateMediaResponse,
-    CreateRoomBody,
     CreateRoomResponse,
-    CreationContent,
     ErrorResponse,
-    ImageInfo,
     MsgType,
+    RedactMessageResponse,
     RelatesTo,
-    RoomEventFilter,
     RoomMessage,
-    RoomMessagesResponse,
     RoomSendEventResponse,
-    StateEvent,
 )
-from matrix_room_import.concurrency_events import SyncTaskSems
-from matrix_room_import.config import Config, load_config
+from matrix_room_import.appservice.uploads import upload_routes
+from matrix_room_import.attachment_crypto import (
+    AttachmentDecryptor,
+    has_attachment_crypto,
+)
+from matrix_room_import.concurrency_events import (
+    ServerStats,
+    SyncTaskSems,
+)
+from matrix_room_import.config import Config, load_config, parse_cache_dir
 from matrix_room_import.db_migrations import execute_migrations
 from matrix_room_import.export_file_model import (
     ExportFile,
-    GenericEvent,
-    GuestAccessEvent,
-    HistoryVisibilityEvent,
-    JoinRulesEvent,
-    MemberContent,
-    MemberEvent,
-    MessageEvent,
     SpaceChildContent,
-    TopicEvent,
 )
+from matrix_room_import.export_index import ExportIndex
+from matrix_room_import.export_parser import (
+    PARSE_ERRORS,
+    Attachment,
+    ParsedExport,
+    evict_parse_cache,
+    is_export,
+    parse_export,
+    read_attachment,
+    sniff_room_id,
+)
+from matrix_room_import.id_rewriter import get_id_rewriter
+from matrix_room_import.import_plan import ImportPlan, Operation, OperationKind
 from matrix_room_import.stores import (
+    ImportStatus,
+    MigratedRoom,
     Process,
     RoomEvent,
     get_config_store,
+    get_event_mapping_store,
+    get_imports_store,
+    get_media_transfer_store,
+    get_migrated_rooms_store,
     get_queue_store,
     get_rooms_to_remove_store,
 )
@@ -71,24 +87,6 @@ def get_room_id(data: ExportFile) -> str:
     raise ValueError("No message with room_id.")
 
 
-def get_join_rule(data: ExportFile) -> str:
-    for message in data.messages:
-        if isinstance(message, JoinRulesEvent):
-            return message.content.join_rule
-    return "invite"
-
-
-def get_room_creator_id(data: ExportFile) -> str:
-    for message in data.messages:
-        print(type(message))
-        if (
-            isinstance(message, MemberEvent)
-            and message.content.displayname == data.room_creator
-        ):
-            return message.sender
-    raise ValueError("No creator in the room")
-
-
 async def signal_import_room_started(config: Config, process: Process, client: Client):
     bot_userid = f"@{config.as_id}:{config.server_name}"
     await client.send_event(
@@ -158,269 +156,495 @@ async def signal_import_failed(
     )
 
 
+# Failures of an import that did not come from the homeserver.
+def import_error(error: str) -> ErrorResponse:
+    return ErrorResponse(statuscode=500, errcode="M_UNKNOWN", error=error)
+
+
 async def create_room(
-    client: Client, data: ExportFile
+    client: Client, operation: Operation
 ) -> CreateRoomResponse | ErrorResponse:
-    initial_state: list[StateEvent] = []
-    creation_content = CreationContent(federate=False)
-    ts: int | None = None
-    user_id: str | None = None
-    room_topic: str | None = None
-    for message in data.messages:
-        if (
-            isinstance(message, MemberEvent)
-            and message.content.displayname == data.room_creator
-        ):
-            user_id = message.sender
-            ts = message.origin_server_ts
-        elif isinstance(
-            message, (JoinRulesEvent, HistoryVisibilityEvent, GuestAccessEvent)
-        ):
-            initial_state.append(
-                StateEvent(
-                    content=message.content,
-                    state_key=message.state_key,
-                    type=message.type,
-                )
-            )
-        elif isinstance(message, TopicEvent):
-            room_topic = message.content.topic
-    create_room_body = CreateRoomBody(
-        initial_state=initial_state,
-        creation_content=creation_content,
-        name=data.room_name,
-        topic=room_topic,
+    return await client.create_room(
+        operation.content or {}, operation.user_id, operation.ts
     )
-    return await client.create_room(create_room_body, user_id, ts)
 
 
-def get_filename(name: str):
-    parts = name.split(".")
-    ext = parts[-1]
-    stem = ".".join(parts[:-1])
-    stem_parts = " at ".join(stem.split(" at ")[:-1]).split("-")[:-3]
-    return "-".join(stem_parts) + "." + ext
+# Reads an attachment from its archive in a worker thread, chunk by chunk.
+async def attachment_chunks(attachment: Attachment) -> AsyncIterator[bytes]:
+    chunks = read_attachment(attachment)
+    try:
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+    finally:
+        await asyncio.to_thread(chunks.close)
 
 
-def get_file_mimetype(data: ExportFile) -> dict[str, str]:
-    mimetypes: dict[str, str] = {}
-    for message in data.messages:
-        if isinstance(message, MessageEvent):
-            mimetype = message.content.info.get("mimetype", None)
-            if mimetype is not None:
-                mimetypes[message.content.body] = mimetype
-    return mimetypes
-
-
-def load_export_file(file_path: Path) -> ExportFile:
-    with open(file_path) as export_file:
-        data = ExportFile.model_validate(json.loads(export_file.read()))
-    return data
-
-
-def load_zip_export(
-    zip_path: Path,
-) -> tuple[ExportFile | None, dict[str, bytes]]:
-    files: dict[str, bytes] = {}
-    data: ExportFile | None = None
-    with ZipFile(zip_path) as zip:
-        print(zip.namelist())
-        for name in zip.namelist():
-            filepath = name.split("/")
-            if len(filepath) < 2:
-                continue
-            if filepath[1] == "export.json":
-                with zip.open(name) as export_file:
-                    data = ExportFile.model_validate(json.loads(export_file.read()))
-            elif (
-                filepath[1] in ["images", "files"]
-                and len(filepath) > 2
-                and filepath[2] != ""
-            ):
-                with zip.open(name) as export_file:
-                    filename = get_filename(filepath[2])
-                    files[filename] = export_file.read()
-            else:
-                print(f"skipped {name}")
-
-    return data, files
+async def upload_media(
+    client: Client, plan: ImportPlan, files: dict[str, Attachment]
+) -> dict[str, str]:
+    file_paths: dict[str, str] = {}
+    for operation in plan.uploads:
+        if operation.kind != OperationKind.upload_media:
+            continue
+        assert operation.media is not None
+        attachment = files[operation.media]
+        mimetype = operation.content.get("mimetype") if operation.content else None
+        resp = await client.create_media()
+        if not isinstance(resp, CreateMediaResponse):
+            continue
+        server_name, _, media_id = resp.content_uri[6:].partition("/")
+        upload_resp = await client.upload_media(
+            server_name,
+            media_id,
+            attachment_chunks(attachment),
+            operation.media,
+            mimetype,
+            content_length=attachment.size,
+        )
+        if not isinstance(upload_resp, ErrorResponse):
+            file_paths[operation.media] = resp.content_uri
+    return file_paths
+
+
+def get_source_client(config: Config) -> Client | None:
+    if config.source_homeserver_url is None or config.source_access_token is None:
+        return None
+    return Client(
+        config.source_homeserver_url,
+        config.source_access_token,
+        config.as_id,
+        config.source_access_token,
+    )
+
+
+# The last chunk is held back until the hash of the attachment is checked, so
+# that the upload of a corrupted attachment never completes.
+async def decrypted_chunks(
+    decryptor: AttachmentDecryptor, chunks: AsyncIterable[bytes]
+) -> AsyncIterator[bytes]:
+    previous: bytes | None = None
+    async for chunk in chunks:
+        decrypted = await asyncio.to_thread(decryptor.update, chunk)
+        if previous is not None:
+            yield previous
+        previous = decrypted
+    decryptor.verify()
+    if previous is not None:
+        yield previous
+
+
+async def transfer_one_media(
+    source_client: Client,
+    client: Client,
+    operation: Operation,
+    encrypted_file: Any = None,
+) -> str | None:
+    assert operation.media is not None
+    resp = await client.create_media()
+    if not isinstance(resp, CreateMediaResponse):
+        LOGGER.error("Could not create media for %s: %s", operation.media, resp)
+        return None
+    server_name, _, media_id = resp.content_uri[6:].partition("/")
+    content = operation.content or {}
+    mimetype = content.get("mimetype")
+    decryptor = (
+        AttachmentDecryptor.from_content(encrypted_file)
+        if encrypted_file is not None
+        else None
+    )
+    async with source_client.stream_media(operation.media) as response:
+        if response.status != 200:
+            LOGGER.error(
+                "Could not download %s: %s", operation.media, await response.text()
+            )
+            return None
+        chunks: AsyncIterator[bytes]
+        if decryptor is None:
+            chunks = response.content.iter_chunked(1 << 16)
+        else:
+            # AES-CTR keeps the size of the attachment.
+            chunks = decrypted_chunks(decryptor, response.content.iter_chunked(1 << 20))
+            mimetype = mimetype or "application/octet-stream"
+        upload_resp = await client.upload_media(
+            server_name,
+            media_id,
+            chunks,
+            content_type=mimetype or response.content_type,
+            content_length=response.content_length,
+        )
+    if isinstance(upload_resp, ErrorResponse):
+        LOGGER.error("Could not upload %s: %s", operation.media, upload_resp)
+        return None
+    return resp.content_uri
+
+
+# Copies the media referenced by an export made without attachments from the
+# source homeserver, without buffering whole files.
+async def transfer_media(
+    source_client: Client, client: Client, config: Config, plan: ImportPlan
+) -> dict[str, str]:
+    transfer_store = get_media_transfer_store(config)
+    operations = [
+        operation
+        for operation in plan.uploads
+        if operation.kind == OperationKind.transfer_media
+    ]
+    if plan.encrypted_files and not has_attachment_crypto():
+        raise ValueError(
+            f"{len(plan.encrypted_files)} attachments are encrypted, install the "
+            "encrypted-attachments extra to decrypt them"
+        )
+    file_paths = transfer_store.load(
+        [operation.media for operation in operations if operation.media is not None]
+    )
+    sem = asyncio.Semaphore(config.media_transfer_concurrency)
+
+    async def transfer(operation: Operation):
+        async with sem:
+            try:
+                content_uri = await transfer_one_media(
+                    source_client,
+                    client,
+                    operation,
+                    plan.encrypted_files.get(operation.media or ""),
+                )
+            # ValueError: attachments failing to decrypt.
+            except (*REQUEST_ERRORS, ValueError):
+                LOGGER.exception("Could not transfer %s", operation.media)
+                return
+        if content_uri is not None and operation.media is not None:
+            file_paths[operation.media] = content_uri
+            transfer_store.save(operation.media, content_uri)
+
+    await asyncio.gather(
+        *(
+            transfer(operation)
+            for operation in operations
+            if operation.media not in file_paths
+        )
+    )
+    return file_paths
+
+
+async def prepare_media(
+    client: Client,
+    config: Config,
+    parsed: ParsedExport,
+    source_client: Client | None,
+) -> dict[str, str]:
+    file_paths = await upload_media(client, parsed.plan, parsed.files)
+    # release the attachments before the replay, they are uploaded.
+    parsed.files = {}
+    if config.transfer_media and source_client is not None:
+        file_paths |= await transfer_media(source_client, client, config, parsed.plan)
+    return file_paths
+
+
+def remap_relations(content: dict[str, Any], event_id_mapping: dict[str, str]):
+    relates_to = content.get("m.relates_to")
+    if relates_to is None:
+        return
+    if "event_id" in relates_to:
+        relates_to["event_id"] = event_id_mapping.get(
+            relates_to["event_id"], relates_to["event_id"]
+        )
+    in_reply_to = relates_to.get("m.in_reply_to")
+    if in_reply_to is not None:
+        in_reply_to["event_id"] = event_id_mapping.get(
+            in_reply_to["event_id"], in_reply_to["event_id"]
+        )
 
 
 async def populate_message(
     client: Client,
-    data: ExportFile,
+    operations: Iterable[Operation],
     new_room_id: str,
-    room_creator_id: str,
     file_paths: dict[str, str],
-) -> tuple[list[str], dict[str, str]]:
-    new_event_ids: dict[str, str] = {}
-    users_in_room: list[str] = []
-    initial_creator_room_join = True
-
-    for message in data.messages:
-        print(message.type)
-        print(type(message))
-        print(message.content)
-        if isinstance(message, MemberEvent):
-            if message.content.membership == "join":
-                users_in_room.append(message.sender)
-            elif message.content.membership in ["leave", "ban"]:
-                if message.sender in users_in_room:
-                    users_in_room.remove(message.sender)
-
-            if (
-                message.sender == room_creator_id
-                and message.content.membership == "join"
-                and initial_creator_room_join
-            ):
-                initial_creator_room_join = False
-                continue
+    event_id_mapping: dict[str, str] | None = None,
+    encrypted_media: Collection[str] = (),
+) -> tuple[dict[str, str], list[Operation]]:
+    new_event_ids: dict[str, str] = dict(event_id_mapping or {})
+    reactions: list[Operation] = []
+
+    for operation in operations:
+        print(operation.kind, operation.event_id)
+        assert operation.event_id is not None and operation.content is not None
+        resp: RoomSendEventResponse | RedactMessageResponse | ErrorResponse
+        if operation.kind == OperationKind.send_state:
             resp = await client.send_state_event(
-                message.type,
+                operation.type or "",
                 new_room_id,
-                MemberContent(
-                    membership=message.content.membership,
-                    displayname=message.content.displayname,
-                    avatar_url=message.content.avatar_url,
-                ).model_dump(exclude_defaults=True, by_alias=True),
-                message.state_key,
-                user_id=message.sender,
-                ts=message.origin_server_ts,
+                operation.content,
+                operation.state_key or "",
+                user_id=operation.user_id,
+                ts=operation.ts,
             )
-            if isinstance(resp, RoomSendEventResponse):
-                new_event_ids[message.event_id] = resp.event_id
-            else:
-                print("ERROR - ", resp)
-        elif (
-            isinstance(message, MessageEvent)
-            and message.content.info.get("mimetype", None) is not None
-            and message.content.body in file_paths
-        ):
-            print("FILE")
-            image_h = message.content.info.get("h", None)
-            image_mimetype = message.content.info.get("mimetype", None)
-            image_size = message.content.info.get("size", None)
-            image_w = message.content.info.get("w", None)
+        elif operation.kind == OperationKind.send_event:
+            if operation.media is not None:
+                if operation.media in file_paths:
+                    operation.content["url"] = file_paths[operation.media]
+                elif (
+                    operation.media.startswith("mxc://")
+                    and operation.media not in encrypted_media
+                ):
+                    # not transferred, keep pointing to the source media.
+                    operation.content["url"] = operation.media
+                else:
+                    print("SKIPPED")
+                    continue
+            remap_relations(operation.content, new_event_ids)
             resp = await client.send_event(
-                message.type,
+                operation.type or "",
                 new_room_id,
-                RoomMessage(
-                    msgtype=message.content.msgtype,
-                    body=message.content.body,
-                    url=file_paths[message.content.body],
-                    info=ImageInfo(
-                        h=image_h, mimetype=image_mimetype, size=image_size, w=image_w
-                    ),
-                    mentions=message.content.mentions,
-                    relates_to=message.content.relates_to,
-                ),
-                user_id=message.sender,
-                ts=message.origin_server_ts,
+                operation.content,
+                user_id=operation.user_id,
+                ts=operation.ts,
             )
-            if isinstance(resp, RoomSendEventResponse):
-                new_event_ids[message.event_id] = resp.event_id
-            else:
-                print("ERROR - ", resp)
-        elif isinstance(message, MessageEvent) and message.content.file is None:
-            print("MESSAGE")
-            if message.content.relates_to is not None:
-                if message.content.relates_to.event_id is not None:
-                    message.content.relates_to.event_id = new_event_ids.get(
-                        message.content.relates_to.event_id,
-                        message.content.relates_to.event_id,
-                    )
-                if message.content.relates_to.in_reply_to is not None:
-                    message.content.relates_to.in_reply_to.event_id = new_event_ids.get(
-                        message.content.relates_to.in_reply_to.event_id,
-                        message.content.relates_to.in_reply_to.event_id,
-                    )
-
-            resp = await client.send_event(
-                message.type,
+        elif operation.kind == OperationKind.redact:
+            redacted_event_id = operation.content["redacts"]
+            if redacted_event_id not in new_event_ids:
+                continue
+            resp = await client.redact_message(
                 new_room_id,
-                RoomMessage(
-                    msgtype=message.content.msgtype,
-                    body=message.content.body,
-                    format=message.content.format,
-                    formatted_body=message.content.formatted_body,
-                    mentions=message.content.mentions,
-                    relates_to=message.content.relates_to,
-                ),
-                user_id=message.sender,
-                ts=message.origin_server_ts,
+                new_event_ids[redacted_event_id],
+                reason=operation.content.get("reason"),
+                user_id=operation.user_id,
+                ts=operation.ts,
             )
-            if isinstance(resp, RoomSendEventResponse):
-                new_event_ids[message.event_id] = resp.event_id
-            else:
-                print("ERROR - ", resp)
-        elif isinstance(message, GenericEvent):
-            print("GENERIC")
+        elif operation.kind == OperationKind.send_reaction:
+            # replayed by `populate_reactions` once all targets are mapped.
+            reactions.append(operation)
+            continue
+        else:
+            print("SKIPPED")
+            continue
+
+        if (
+            isinstance(resp, (RoomSendEventResponse, RedactMessageResponse))
+            and resp.event_id is not None
+        ):
+            new_event_ids[operation.event_id] = resp.event_id
+        else:
+            print("ERROR - ", resp)
+    return new_event_ids, reactions
+
+
+@dataclass
+class ReactionStats:
+    sent: int = 0
+    skipped: int = 0
+    failed: int = 0
+
+
+async def send_reaction(
+    client: Client,
+    new_room_id: str,
+    reaction: Operation,
+    target_event_id: str,
+    retries: int,
+) -> bool:
+    assert reaction.content is not None
+    content = {
+        "m.relates_to": {
+            **reaction.content["m.relates_to"],
+            "event_id": target_event_id,
+        }
+    }
+    # same transaction id on retries so that the homeserver deduplicates sends.
+    txn_id = new_txn()
+    error: ErrorResponse | Exception | None = None
+    for attempt in range(retries + 1):
+        delay_ms = 1000 * 2**attempt
+        try:
             resp = await client.send_event(
-                message.type,
+                "m.reaction",
                 new_room_id,
-                RoomMessage(**message.content),
-                user_id=message.sender,
-                ts=message.origin_server_ts,
+                content,
+                txn_id=txn_id,
+                user_id=reaction.user_id,
+                ts=reaction.ts,
             )
-            if isinstance(resp, RoomSendEventResponse):
-                new_event_ids[message.event_id] = resp.event_id
-            else:
-                print("ERROR - ", resp)
+        # no response, retried like a server error.
+        except REQUEST_ERRORS as e:
+            error = e
         else:
-            print("SKIPPED")
-            print(message)
-    return users_in_room, new_event_ids
-
-
-async def get_room_reactions(client: Client, room_id: str, user_id: str):
-    from_ = None
-    reactions: list[ClientEvent] = []
-    for _ in range(100):
-        old_room_messages = await client.get_room_messages(
-            room_id,
-            dir="f",
-            filter=RoomEventFilter(types=["m.reaction"]),
-            from_=from_,
-            limit=10,
-            user_id=user_id,
-        )
-        if isinstance(old_room_messages, RoomMessagesResponse):
-            from_ = old_room_messages.end
-            if from_ is None:
+            if isinstance(resp, RoomSendEventResponse):
+                return True
+            error = resp
+            if resp.statuscode != 429 and resp.statuscode < 500:
                 break
-            reactions.extend(old_room_messages.chunk)
-    return reactions
+            delay_ms = resp.retry_after_ms or delay_ms
+        if attempt < retries:
+            await asyncio.sleep(delay_ms / 1000)
+    LOGGER.error("Could not send reaction %s: %s", reaction.event_id, error)
+    return False
 
 
 async def populate_reactions(
     client: Client,
     new_room_id: str,
-    reactions: list[ClientEvent],
+    reactions: list[Operation],
     event_id_mapping: dict[str, str],
-):
-    print(event_id_mapping)
+    concurrency: int = 8,
+    retries: int = 3,
+) -> ReactionStats:
+    stats = ReactionStats()
+    by_sender: dict[str | None, list[tuple[Operation, str]]] = {}
     for reaction in reactions:
-        print("REACTION")
-        print(reaction)
-        if reaction.content["m.relates_to"]["event_id"] not in event_id_mapping.keys():
-            print("skip")
+        assert reaction.content is not None
+        target_event_id = reaction.content["m.relates_to"]["event_id"]
+        if target_event_id not in event_id_mapping:
+            stats.skipped += 1
             continue
-        await client.send_event(
-            "m.reaction",
-            new_room_id,
-            RoomMessage(
-                relates_to=RelatesTo(
-                    rel_type="m.annotation",
-                    event_id=event_id_mapping[
-                        reaction.content["m.relates_to"]["event_id"]
-                    ],
-                    key=reaction.content["m.relates_to"]["key"],
-                ),
-            ),
-            user_id=reaction.sender,
-            ts=reaction.origin_server_ts,
+        by_sender.setdefault(reaction.user_id, []).append(
+            (reaction, event_id_mapping[target_event_id])
+        )
+
+    sem = asyncio.Semaphore(concurrency)
+
+    # Reactions of a sender are sent in order, senders are sent concurrently.
+    async def send_sender_reactions(sender_reactions: list[tuple[Operation, str]]):
+        async with sem:
+            for reaction, target_event_id in sender_reactions:
+                sent = await send_reaction(
+                    client, new_room_id, reaction, target_event_id, retries
+                )
+                if sent:
+                    stats.sent += 1
+                else:
+                    stats.failed += 1
+
+    results = await asyncio.gather(
+        *(
+            send_sender_reactions(sender_reactions)
+            for sender_reactions in by_sender.values()
+        ),
+        return_exceptions=True,
+    )
+    LOGGER.info("Reactions: %s", stats)
+    # raised once the reactions of every other sender are sent.
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return stats
+
+
+async def run_import(
+    client: Client,
+    config: Config,
+    parsed: ParsedExport,
+    source_client: Client | None = None,
+) -> tuple[CreateRoomResponse | ErrorResponse, list[str]]:
+    plan = parsed.plan
+    room_creator_id = plan.create_room.user_id
+    if room_creator_id is None:
+        raise ValueError("No creator in the room")
+
+    file_paths = await prepare_media(client, config, parsed, source_client)
+
+    room_resp = await create_room(client, plan.create_room)
+    if isinstance(room_resp, CreateRoomResponse):
+        if config.space_id is not None:
+            print(f"Adding room to space {config.space_id}")
+            resp = await client.send_state_event(
+                "m.space.child",
+                config.space_id,
+                SpaceChildContent(
+                    via=[config.server_name],
+                ).model_dump(exclude_defaults=True),
+                room_resp.room_id,
+                user_id=room_creator_id,
+            )
+            print(resp)
+
+        event_id_mapping, reactions = await populate_message(
+            client,
+            plan.timeline,
+            room_resp.room_id,
+            file_paths,
+            encrypted_media=plan.encrypted_files,
+        )
+        await populate_reactions(
+            client,
+            room_resp.room_id,
+            reactions,
+            event_id_mapping,
+            config.reaction_concurrency,
+            config.reaction_retries,
+        )
+        record_migration(config, parsed.index, room_resp.room_id, event_id_mapping)
+    return room_resp, plan.users_in_room
+
+
+def record_migration(
+    config: Config,
+    index: ExportIndex,
+    target_room_id: str,
+    event_id_mapping: dict[str, str],
+):
+    get_migrated_rooms_store(config).append(
+        MigratedRoom(
+            source_room_id=index.room_id,
+            target_room_id=target_room_id,
+            last_event_id=index.last_event_id,
+            last_ts=index.last_ts,
         )
-    print("done")
+    )
+    get_event_mapping_store(config).save(target_room_id, event_id_mapping)
+
+
+# Replays the events following the last imported one into the target room of
+# a previous import, relations to already imported events use the stored
+# mapping.
+async def run_delta_import(
+    client: Client,
+    config: Config,
+    parsed: ParsedExport,
+    migrated_room_key: int,
+    source_client: Client | None = None,
+) -> int:
+    migrated_rooms = get_migrated_rooms_store(config)
+    migrated_room = migrated_rooms[migrated_room_key]
+    target_room_id = migrated_room.target_room_id
+    mapping_store = get_event_mapping_store(config)
+    previous_mapping = mapping_store.load(target_room_id)
+
+    plan = parsed.plan
+    file_paths = await prepare_media(client, config, parsed, source_client)
+
+    timeline = [
+        operation
+        for operation in plan.timeline
+        if operation.event_id not in previous_mapping
+    ]
+    event_id_mapping, reactions = await populate_message(
+        client,
+        timeline,
+        target_room_id,
+        file_paths,
+        previous_mapping,
+        plan.encrypted_files,
+    )
+    await populate_reactions(
+        client,
+        target_room_id,
+        reactions,
+        event_id_mapping,
+        config.reaction_concurrency,
+        config.reaction_retries,
+    )
+    mapping_store.save(
+        target_room_id,
+        {
+            source_event_id: target_event_id
+            for source_event_id, target_event_id in event_id_mapping.items()
+            if source_event_id not in previous_mapping
+        },
+    )
+    migrated_rooms.set_last_event(
+        migrated_room_key, parsed.index.last_event_id, parsed.index.last_ts
+    )
+    return len(timeline)
 
 
 async def http_server_task_runner(
@@ -428,11 +652,16 @@ async def http_server_task_runner(
 ):
     app = Application()
     app.add_routes(
-        [web.put("/_matrix/app/v1/transactions/{txnId}", server.handle_transaction)]
+        [
+            web.put("/_matrix/app/v1/transactions/{txnId}", server.handle_transaction),
+            web.get("/_matrix_room_import/v1/stats", server.handle_stats),
+            *upload_routes(),
+        ]
     )
     app[config_key] = config
     app[client_key] = client
     app[sync_sem_key] = sync_tasks_sem
+    app[stats_key] = ServerStats()
 
     bot_userid = f"@{config.as_id}:{config.server_name}"
     await client.update_bot_profile(bot_userid, config.bot_displayname)
@@ -444,72 +673,184 @@ async def http_server_task_runner(
     await asyncio.Event().wait()
 
 
+def evict_dropped_parse(future: asyncio.Future[ParsedExport | None]):
+    if future.exception() is None and (parsed := future.result()) is not None:
+        evict_parse_cache(parsed)
+
+
 async def import_task_runner(
-    client: Client, config: Config, sync_tasks_sem: SyncTaskSems
+    client: Client,
+    config: Config,
+    sync_tasks_sem: SyncTaskSems,
+    parse_pool: ProcessPoolExecutor,
 ):
     process_queue = get_queue_store(config)
+    imports_store = get_imports_store(config)
+    source_client = get_source_client(config)
+    rewriter = get_id_rewriter(config)
+    loop = asyncio.get_running_loop()
+    parses: dict[int, asyncio.Future[ParsedExport | None]] = {}
+    # queue key of the first part of a room -> queue keys of its other parts,
+    # uploaded to the same bot room.
+    other_parts: dict[int, list[int]] = {}
+    merged_parts: set[int] = set()
+    source_room_ids: dict[int, str | None] = {}
+
+    async def source_room_id(k: int, process: Process) -> str | None:
+        if k not in source_room_ids:
+            source_room_ids[k] = await asyncio.to_thread(sniff_room_id, process.path)
+        return source_room_ids[k]
+
+    # `scheduled` parts are those of a parse already scheduled, the parts of
+    # other rooms or their first part.
+    async def find_other_parts(
+        k: int, process: Process, scheduled: bool = False
+    ) -> list[int]:
+        room_id = await source_room_id(k, process)
+        if room_id is None:
+            return []
+        return [
+            j
+            for j, other in process_queue.peek(len(process_queue))
+            if j != k
+            and (scheduled or (j not in parses and j not in merged_parts))
+            and other.room_id == process.room_id
+            and is_export(other.path)
+            and await source_room_id(j, other) == room_id
+        ]
+
+    def set_status(
+        event_ids: list[str], status: ImportStatus, new_room_id: str | None = None
+    ):
+        for event_id in event_ids:
+            imports_store.set_status(event_id, status, new_room_id)
+
+    def next_processes() -> list[tuple[int, Process]]:
+        return [
+            (k, process)
+            for k, process in process_queue.peek(len(process_queue))
+            if k not in merged_parts
+        ]
+
+    def schedule_parse(k: int, process: Process):
+        paths = [process.path, *(process_queue[j].path for j in other_parts[k])]
+        parses[k] = loop.run_in_executor(
+            parse_pool,
+            parse_export,
+            paths,
+            config.compact_state_events,
+            config.compact_edits_and_redactions,
+            parse_cache_dir(config),
+            rewriter,
+        )
+
+    # a parse superseded by the parse of more parts, its cache is never used.
+    def drop_parse(k: int):
+        future = parses.pop(k, None)
+        if future is not None:
+            future.add_done_callback(evict_dropped_parse)
+
+    # Queued exports are parsed ahead of time in the process pool, so that
+    # parsing never blocks the event loop and overlaps with the replay.
+    async def schedule_parses():
+        for k, process in next_processes()[: config.parse_workers]:
+            if k not in parses and is_export(process.path):
+                other_parts[k] = await find_other_parts(k, process)
+                merged_parts.update(other_parts[k])
+                schedule_parse(k, process)
+
+    # Parts queued after the parse of the first part of their room was
+    # scheduled, or scheduled on their own, are only found before the import
+    # of the room: it is parsed again with all of them.
+    async def regroup_parts(k: int, process: Process) -> bool:
+        parts = await find_other_parts(k, process, scheduled=True)
+        if set(parts) == set(other_parts[k]):
+            return False
+        LOGGER.info("Parsing %s again with %d parts", process.path, len(parts) + 1)
+        for j in parts:
+            drop_parse(j)
+            other_parts.pop(j, None)
+        drop_parse(k)
+        other_parts[k] = parts
+        merged_parts.update(parts)
+        schedule_parse(k, process)
+        return True
+
+    # parts can still be queued while the room is parsed.
+    async def parse_parts(k: int, process: Process) -> ParsedExport | None:
+        await regroup_parts(k, process)
+        parsed = await parses[k]
+        while await regroup_parts(k, process):
+            parsed = await parses[k]
+        return parsed
 
     while True:
         await sync_tasks_sem.num_export_process_sem.acquire()
-        process = process_queue.get_and_remove_next()
-        if process.path.suffix == ".zip" or process.path.suffix == ".json":
-            if process.path.suffix == ".zip":
-                data, files = load_zip_export(process.path)
-            else:
-                data = load_export_file(process.path)
-                files: dict[str, bytes] = {}
-            file_paths: dict[str, str] = {}
-
-            if data is not None:
-                old_room_id = get_room_id(data)
-                room_creator_id = get_room_creator_id(data)
-
-                mimetype_files = get_file_mimetype(data)
-                for filename, content in files.items():
-                    mimetype = mimetype_files.get(filename, None)
-                    resp = await client.create_and_upload_media(
-                        content, filename, mimetype
-                    )
-                    if isinstance(resp, CreateMediaResponse):
-                        file_paths[filename] = resp.content_uri
-
-                await signal_import_room_started(config, process, client)
-
-                room_reactions = await get_room_reactions(
-                    client, old_room_id, room_creator_id
-                )
+        await schedule_parses()
+        k, process = next_processes()[0]
+        parsed: ParsedExport | None = None
+        if k in parses:
+            try:
+                parsed = await parse_parts(k, process)
+            except (*PARSE_ERRORS, BrokenExecutor):
+                LOGGER.exception("Could not parse %s", process.path)
+            parses.pop(k)
+
+        process_queue.pop(k)
+        source_room_ids.pop(k, None)
+        event_ids = [process.event_id]
+        for j in other_parts.pop(k, []):
+            # each part was counted when queued.
+            await sync_tasks_sem.num_export_process_sem.acquire()
+            event_ids.append(process_queue.pop(j).event_id)
+            merged_parts.discard(j)
+            source_room_ids.pop(j, None)
+        await schedule_parses()
+
+        if not is_export(process.path):
+            set_status(event_ids, ImportStatus.failed)
+            await signal_import_failed(
+                config,
+                process,
+                client,
+                import_error(f"{process.path.name} is not an export"),
+            )
+            continue
+        if parsed is None:
+            set_status(event_ids, ImportStatus.failed)
+            await signal_import_failed(
+                config,
+                process,
+                client,
+                import_error(f"Could not read {process.path.name}"),
+            )
+            continue
 
-                room_resp = await create_room(client, data)
-
-                if isinstance(room_resp, CreateRoomResponse):
-                    if config.space_id is not None:
-                        print(f"Adding room to space {config.space_id}")
-                        resp = await client.send_state_event(
-                            "m.space.child",
-                            config.space_id,
-                            SpaceChildContent(
-                                via=[config.server_name],
-                            ).model_dump(exclude_defaults=True),
-                            room_resp.room_id,
-                            user_id=room_creator_id,
-                        )
-                        print(resp)
-
-                    users, event_id_mapping = await populate_message(
-                        client,
-                        data,
-                        room_resp.room_id,
-                        room_creator_id,
-                        file_paths,
-                    )
-                    await populate_reactions(
-                        client, room_resp.room_id, room_reactions, event_id_mapping
-                    )
-                    await signal_import_ended(
-                        config, process, client, room_resp.room_id, old_room_id, users
-                    )
-                else:
-                    await signal_import_failed(config, process, client, room_resp)
+        await signal_import_room_started(config, process, client)
+        old_room_id = parsed.index.room_id
+        users_in_room: list[str] = []
+        try:
+            room_resp, users_in_room = await run_import(
+                client, config, parsed, source_client
+            )
+        except (*PARSE_ERRORS, *REQUEST_ERRORS) as e:
+            LOGGER.exception("Could not import %s", process.path)
+            room_resp = import_error(f"Could not import {process.path.name}: {e}")
+
+        if isinstance(room_resp, CreateRoomResponse):
+            await signal_import_ended(
+                config,
+                process,
+                client,
+                room_resp.room_id,
+                old_room_id,
+                users_in_room,
+            )
+            set_status(event_ids, ImportStatus.done, room_resp.room_id)
+            evict_parse_cache(parsed)
+        else:
+            set_status(event_ids, ImportStatus.failed)
+            await signal_import_failed(config, process, client, room_resp)
 
 
 async def main():
@@ -532,12 +873,20 @@ async def main():
     server_task = asyncio.create_task(
         http_server_task_runner(config, client, sync_tasks_sem)
     )
-    import_task = asyncio.create_task(
-        import_task_runner(client, config, sync_tasks_sem)
+    download_task = asyncio.create_task(
+        download_task_runner(client, config, sync_tasks_sem)
     )
+    # forked workers would inherit the state of the threads already running.
+    with ProcessPoolExecutor(
+        config.parse_workers, mp_context=multiprocessing.get_context("forkserver")
+    ) as parse_pool:
+        import_task = asyncio.create_task(
+            import_task_runner(client, config, sync_tasks_sem, parse_pool)
+        )
 
-    await server_task
-    await import_task
+        await server_task
+        await download_task
+        await import_task
 
 
 @click.command("serve")
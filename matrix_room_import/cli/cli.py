@@ -1,6 +1,10 @@
 import click
 
 from .bot import serve
+from .delta import delta
+from .import_dir import import_dir
+from .migrate import migrate
+from .plan import plan
 
 
 @click.group()
@@ -9,3 +13,7 @@ def root():
 
 
 root.add_command(serve)
+root.add_command(plan)
+root.add_command(import_dir)
+root.add_command(migrate)
+root.add_command(delta)
@@ -0,0 +1,100 @@
+import asyncio
+from pathlib import Path
+
+import click
+
+from matrix_room_import import LOGGER, PROJECT_DIR
+from matrix_room_import.appservice.client import REQUEST_ERRORS, Client
+from matrix_room_import.config import Config, load_config
+from matrix_room_import.db_migrations import execute_migrations
+from matrix_room_import.export_file_model import ExportFile
+from matrix_room_import.export_parser import (
+    PARSE_ERRORS,
+    Attachment,
+    compile_export,
+    is_export,
+    load_export,
+)
+from matrix_room_import.id_rewriter import get_id_rewriter
+from matrix_room_import.room_source import SourceRoomError, fetch_room_history
+from matrix_room_import.stores import get_migrated_rooms_store
+
+from .bot import get_room_id, get_source_client, run_delta_import
+
+
+async def delta_import(client: Client, config: Config, source: str) -> str:
+    migrated_rooms = get_migrated_rooms_store(config)
+    path = Path(source)
+    files: dict[str, Attachment] = {}
+    data: ExportFile | None = None
+    if is_export(path) and await asyncio.to_thread(path.is_file):
+        data, files = await asyncio.to_thread(load_export, path)
+        if data is None:
+            return "no export.json in the archive"
+        room_id = get_room_id(data)
+    else:
+        room_id = source
+
+    found = migrated_rooms.from_source_room(room_id)
+    if found is None:
+        return f"{room_id} was never imported, import it first"
+    migrated_room_key, migrated_room = found
+
+    source_client = get_source_client(config)
+    if data is None:
+        if source_client is None:
+            return "no source homeserver configured to page the room"
+        data = await fetch_room_history(
+            source_client,
+            room_id,
+            config.source_page_size,
+            since_event_id=migrated_room.last_event_id,
+        )
+    if len(data.messages) == 0:
+        return "up to date"
+
+    parsed = await asyncio.to_thread(
+        compile_export,
+        data,
+        files,
+        since_event_id=migrated_room.last_event_id,
+        since_ts=migrated_room.last_ts,
+        rewriter=get_id_rewriter(config),
+    )
+    del data
+    if len(parsed.plan.timeline) == 0:
+        return "up to date"
+
+    count = await run_delta_import(
+        client, config, parsed, migrated_room_key, source_client
+    )
+    return f"{count} events imported into {migrated_room.target_room_id}"
+
+
+async def delta_main(sources: tuple[str, ...]):
+    config = load_config()
+    LOGGER.debug("CONFIG: %s", config.model_dump())
+
+    execute_migrations(PROJECT_DIR / config.database_location)
+
+    client = Client(
+        config.homeserver_url, config.as_token, config.as_id, config.admin_token
+    )
+    for source in sources:
+        try:
+            result = await delta_import(client, config, source)
+        except (*PARSE_ERRORS, *REQUEST_ERRORS, SourceRoomError):
+            LOGGER.exception("Could not import the delta of %s", source)
+            result = "failed"
+        click.echo(f"{source}: {result}")
+
+
+@click.command("delta")
+@click.argument("sources", nargs=-1, required=True)
+def delta(sources: tuple[str, ...]):
+    """Import the events that followed a previous import of a room.
+
+    Each SOURCE is either a newer export of the room or the id of the room on
+    the source homeserver, which is then paged from the last imported event.
+    """
+    asyncio.run(delta_main(sources))
@@ -0,0 +1,275 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import click
+
+from matrix_room_import import LOGGER, PROJECT_DIR
+from matrix_room_import.appservice.client import REQUEST_ERRORS, Client
+from matrix_room_import.appservice.types import CreateRoomResponse
+from matrix_room_import.config import Config, load_config, parse_cache_dir
+from matrix_room_import.db_migrations import execute_migrations
+from matrix_room_import.export_parser import (
+    PARSE_ERRORS,
+    evict_parse_cache,
+    is_export,
+    parse_export,
+    parts_sha256,
+    sniff_room_id,
+)
+from matrix_room_import.id_rewriter import get_id_rewriter
+from matrix_room_import.stores import (
+    ImportRecord,
+    ImportsStore,
+    ImportStatus,
+    get_config_store,
+    get_imports_store,
+)
+
+from .bot import get_source_client, run_import
+
+
+@dataclass
+class ImportDirProgress:
+    queued: int = 0
+    done: int = 0
+    failed: int = 0
+    skipped: int = 0
+
+    @property
+    def finished(self) -> int:
+        return self.done + self.failed + self.skipped
+
+    def __str__(self) -> str:
+        return (
+            f"{self.finished}/{self.queued} processed: {self.done} imported, "
+            f"{self.failed} failed, {self.skipped} already imported"
+        )
+
+
+def scan_exports(directory: Path) -> list[Path]:
+    # hidden files are partial copies, e.g. of rsync, plans do not have an
+    # export suffix.
+    return sorted(
+        path
+        for path in directory.iterdir()
+        if path.is_file() and is_export(path) and not path.name.startswith(".")
+    )
+
+
+# Parts of a room, found by one scan or by later scans while the room is not
+# parsed yet.
+@dataclass
+class PartsGroup:
+    paths: list[Path]
+    # the room is being imported, later parts are queued on their own.
+    closed: bool = False
+
+
+async def import_path(
+    client: Client,
+    config: Config,
+    parse_pool: ProcessPoolExecutor,
+    imports_store: ImportsStore,
+    group: PartsGroup,
+) -> ImportStatus | None:
+    # Directory imports have no bot room, the path takes the place of the
+    # event id so that an interrupted import of the same file is retried.
+    path = group.paths[0]
+    import_id = str(path.resolve())
+    loop = asyncio.get_running_loop()
+    # parsed again when parts of the room landed while it was parsed.
+    while True:
+        paths = list(group.paths)
+        sha256 = await asyncio.to_thread(parts_sha256, paths)
+        previous_import = imports_store.from_sha256(sha256)
+        if previous_import is not None and not (
+            previous_import.status == ImportStatus.pending
+            and previous_import.event_id == import_id
+        ):
+            return None
+        # a failed or changed file is retried in the record of its path, so
+        # that the record of its last import is the one holding its status.
+        record = ImportRecord(
+            sha256=sha256, status=ImportStatus.pending, event_id=import_id, room_id=""
+        )
+        found = imports_store.from_event_id(import_id)
+        if found is None or found[1].status == ImportStatus.done:
+            imports_store.append(record)
+        else:
+            imports_store.update(found[0], record)
+
+        try:
+            parsed = await loop.run_in_executor(
+                parse_pool,
+                parse_export,
+                paths,
+                config.compact_state_events,
+                config.compact_edits_and_redactions,
+                parse_cache_dir(config),
+                get_id_rewriter(config),
+            )
+        except (*PARSE_ERRORS, BrokenExecutor):
+            LOGGER.exception("Could not parse %s", path)
+            imports_store.set_status(import_id, ImportStatus.failed)
+            return ImportStatus.failed
+        if parsed is None:
+            LOGGER.error("No export.json in %s", path)
+            imports_store.set_status(import_id, ImportStatus.failed)
+            return ImportStatus.failed
+        if len(paths) == len(group.paths):
+            break
+        LOGGER.info("Parsing %s again with %d parts", path, len(group.paths))
+        evict_parse_cache(parsed)
+    group.closed = True
+
+    try:
+        room_resp, _ = await run_import(
+            client, config, parsed, get_source_client(config)
+        )
+    except (*PARSE_ERRORS, *REQUEST_ERRORS):
+        LOGGER.exception("Could not import %s", path)
+        imports_store.set_status(import_id, ImportStatus.failed)
+        return ImportStatus.failed
+
+    if not isinstance(room_resp, CreateRoomResponse):
+        LOGGER.error("Could not create the room of %s: %s", path, room_resp)
+        imports_store.set_status(import_id, ImportStatus.failed)
+        return ImportStatus.failed
+    imports_store.set_status(import_id, ImportStatus.done, room_resp.room_id)
+    evict_parse_cache(parsed)
+    return ImportStatus.done
+
+
+async def import_dir_worker(
+    client: Client,
+    config: Config,
+    parse_pool: ProcessPoolExecutor,
+    queue: "asyncio.Queue[PartsGroup]",
+    progress: ImportDirProgress,
+):
+    imports_store = get_imports_store(config)
+    while True:
+        group = await queue.get()
+        # closed even if it was never parsed, a part of the same room landing
+        # now is queued on its own.
+        status = await import_path(client, config, parse_pool, imports_store, group)
+        group.closed = True
+        if status is None:
+            progress.skipped += 1
+            label = "skipped"
+        elif status == ImportStatus.done:
+            progress.done += 1
+            label = "imported"
+        else:
+            progress.failed += 1
+            label = "failed"
+        click.echo(
+            f"[{progress}] {label} {', '.join(path.name for path in group.paths)}"
+        )
+        queue.task_done()
+
+
+async def import_dir_main(
+    directory: Path, parallelism: int, watch: bool, interval: float
+):
+    config = load_config()
+    LOGGER.debug("CONFIG: %s", config.model_dump())
+
+    execute_migrations(PROJECT_DIR / config.database_location)
+    config.space_id = get_config_store(config).from_key("spaceId")
+
+    client = Client(
+        config.homeserver_url, config.as_token, config.as_id, config.admin_token
+    )
+
+    progress = ImportDirProgress()
+    queue: asyncio.Queue[PartsGroup] = asyncio.Queue()
+    queued: set[Path] = set()
+    # groups by sniffed room id, or by path for files without one.
+    groups: dict[str | Path, PartsGroup] = {}
+    # In watch mode a file is queued once its size did not change between two
+    # scans, so that files still being copied are not picked up.
+    sizes: dict[Path, int] = {}
+
+    # forked workers would inherit the state of the threads already running.
+    with ProcessPoolExecutor(
+        config.parse_workers, mp_context=multiprocessing.get_context("forkserver")
+    ) as parse_pool:
+        workers = [
+            asyncio.create_task(
+                import_dir_worker(client, config, parse_pool, queue, progress)
+            )
+            for _ in range(parallelism)
+        ]
+        while True:
+            for path in scan_exports(directory):
+                if path in queued:
+                    continue
+                if watch:
+                    size = path.stat().st_size
+                    if sizes.get(path) != size:
+                        sizes[path] = size
+                        continue
+                    del sizes[path]
+                queued.add(path)
+                # exports of the same room are imported as parts of one room,
+                # also when they land in different scans.
+                key = await asyncio.to_thread(sniff_room_id, path) or path
+                group = groups.get(key)
+                if group is not None and not group.closed:
+                    group.paths.append(path)
+                    continue
+                groups[key] = PartsGroup([path])
+                progress.queued += 1
+                queue.put_nowait(groups[key])
+            if not watch:
+                break
+            await asyncio.sleep(interval)
+
+        await queue.join()
+        for worker in workers:
+            worker.cancel()
+    click.echo(f"Done. {progress}")
+
+
+@click.command("import-dir")
+@click.argument(
+    "directory",
+    required=False,
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+)
+@click.option(
+    "--parallel",
+    type=click.IntRange(min=1),
+    help="Number of exports imported at the same time "
+    "(defaults to import_dir_parallelism).",
+)
+@click.option("--watch", is_flag=True, help="Keep importing new files as they land.")
+@click.option(
+    "--interval",
+    default=10.0,
+    show_default=True,
+    help="Seconds between two scans in watch mode.",
+)
+def import_dir(
+    directory: Path | None, parallel: int | None, watch: bool, interval: float
+):
+    """Import every export of a directory (defaults to path_to_import_files)."""
+    config = load_config()
+    if directory is None:
+        directory = PROJECT_DIR / config.path_to_import_files
+        if not directory.is_dir():
+            raise click.BadParameter(
+                f"{directory} is not a directory", param_hint="DIRECTORY"
+            )
+    asyncio.run(
+        import_dir_main(
+            directory,
+            parallel or config.import_dir_parallelism,
+            watch,
+            interval,
+        )
+    )
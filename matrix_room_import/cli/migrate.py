@@ -0,0 +1,85 @@
+import asyncio
+
+import click
+
+from matrix_room_import import LOGGER, PROJECT_DIR
+from matrix_room_import.appservice.client import REQUEST_ERRORS, Client
+from matrix_room_import.appservice.types import CreateRoomResponse
+from matrix_room_import.config import Config, load_config
+from matrix_room_import.db_migrations import execute_migrations
+from matrix_room_import.export_parser import compile_export
+from matrix_room_import.id_rewriter import get_id_rewriter
+from matrix_room_import.room_source import SourceRoomError, fetch_room_history
+from matrix_room_import.stores import get_config_store
+
+from .bot import get_source_client, run_import
+
+
+async def migrate_room(
+    source_client: Client, client: Client, config: Config, room_id: str
+) -> str | None:
+    data = await fetch_room_history(source_client, room_id, config.source_page_size)
+    if len(data.messages) == 0:
+        LOGGER.error("No readable event in %s", room_id)
+        return None
+    parsed = await asyncio.to_thread(
+        compile_export,
+        data,
+        {},
+        config.compact_state_events,
+        config.compact_edits_and_redactions,
+        rewriter=get_id_rewriter(config),
+    )
+    del data
+
+    room_resp, _ = await run_import(client, config, parsed, source_client)
+    if not isinstance(room_resp, CreateRoomResponse):
+        LOGGER.error("Could not create the room of %s: %s", room_id, room_resp)
+        return None
+    return room_resp.room_id
+
+
+async def migrate_main(room_ids: tuple[str, ...], parallelism: int):
+    config = load_config()
+    LOGGER.debug("CONFIG: %s", config.model_dump())
+
+    execute_migrations(PROJECT_DIR / config.database_location)
+    config.space_id = get_config_store(config).from_key("spaceId")
+
+    source_client = get_source_client(config)
+    if source_client is None:
+        raise click.UsageError(
+            "source_homeserver_url and source_access_token must be configured."
+        )
+    client = Client(
+        config.homeserver_url, config.as_token, config.as_id, config.admin_token
+    )
+    sem = asyncio.Semaphore(parallelism)
+
+    async def migrate(room_id: str):
+        async with sem:
+            try:
+                new_room_id = await migrate_room(source_client, client, config, room_id)
+            except (*REQUEST_ERRORS, SourceRoomError, ValueError):
+                LOGGER.exception("Could not migrate %s", room_id)
+                new_room_id = None
+        if new_room_id is None:
+            click.echo(f"{room_id}: failed")
+        else:
+            click.echo(f"{room_id}: migrated to {new_room_id}")
+
+    await asyncio.gather(*(migrate(room_id) for room_id in room_ids))
+
+
+@click.command("migrate")
+@click.argument("room_ids", nargs=-1, required=True)
+@click.option(
+    "--parallel",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of rooms migrated at the same time.",
+)
+def migrate(room_ids: tuple[str, ...], parallel: int):
+    """Migrate rooms by paging their history on the source homeserver."""
+    asyncio.run(migrate_main(room_ids, parallel))
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import click
+
+from matrix_room_import.export_parser import (
+    EXPORT_SUFFIXES,
+    PARSE_ERRORS,
+    is_export,
+    parse_export,
+)
+from matrix_room_import.import_plan import summarize_plan, write_plan
+
+
+@click.command("plan")
+@click.argument(
+    "export_paths",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--rps",
+    type=click.FloatRange(min=0, min_open=True),
+    default=10.0,
+    show_default=True,
+    help="Requests per second to estimate.",
+)
+@click.option("--compact-state", is_flag=True, help="Elide no-op state events.")
+@click.option(
+    "--compact-edits", is_flag=True, help="Fold edits and skip redacted events."
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Write the plan operations to this file (JSON lines).",
+)
+def plan(
+    export_paths: tuple[Path, ...],
+    rps: float,
+    compact_state: bool,
+    compact_edits: bool,
+    output: Path | None,
+):
+    """Compile an export, or the parts of an export, into its import plan
+    without sending anything."""
+    for export_path in export_paths:
+        if not is_export(export_path):
+            raise click.BadParameter(
+                f"expected one of {', '.join(EXPORT_SUFFIXES)}",
+                param_hint="EXPORT_PATHS",
+            )
+    try:
+        parsed = parse_export(export_paths, compact_state, compact_edits)
+    except PARSE_ERRORS as e:
+        raise click.ClickException(str(e)) from e
+    if parsed is None:
+        raise click.ClickException("No export.json in the archive.")
+    if output is not None:
+        write_plan(output, parsed.plan)
+
+    summary = summarize_plan(parsed.plan)
+    click.echo(f"Room: {parsed.index.room_id}")
+    click.echo("Requests:")
+    for kind, count in summary.requests.most_common():
+        click.echo(f"  {kind:<16} {count:>10}")
+    click.echo(f"  {'total':<16} {summary.total_requests:>10}")
+    click.echo(f"Bytes to upload: {summary.upload_bytes}")
+    click.echo(f"Virtual users: {len(summary.users)}")
+    seconds = summary.duration(rps)
+    click.echo(
+        f"Estimated duration at {rps:g} requests/s: "
+        f"{int(seconds // 3600)}h{int(seconds % 3600 // 60):02d}m{int(seconds % 60):02d}s"
+    )
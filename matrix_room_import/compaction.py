@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+from typing import Any
+
+from pydantic import ValidationError
+
+from matrix_room_import.export_file_model import (
+    ExportFile,
+    HistoryVisibilityEvent,
+    MemberEvent,
+    MessageContent,
+    MessageEvent,
+    ReactionEvent,
+    RedactionEvent,
+)
+from matrix_room_import.state_planner import REPLAYED_STATE_EVENTS
+
+# Dropping a leave/join pair does not change what the user can see in these modes.
+FLAP_HISTORY_VISIBILITIES = ["shared", "world_readable"]
+
+
+@dataclass
+class StateCompactionStats:
+    noop_member: int = 0
+    noop_state: int = 0
+    membership_flaps: int = 0
+
+
+def member_state(message: MemberEvent) -> tuple[str, str | None, str | None]:
+    return (
+        message.content.membership,
+        message.content.displayname,
+        message.content.avatar_url,
+    )
+
+
+def compact_state_events(
+    data: ExportFile,
+) -> tuple[set[str], StateCompactionStats]:
+    stats = StateCompactionStats()
+    elided: set[str] = set()
+    members: dict[str, tuple[str, str | None, str | None]] = {}
+    state: dict[tuple[str, str], Any] = {}
+    history_visibility = "shared"
+    # user_id -> (leave event id, member state before the leave)
+    pending_leaves: dict[str, tuple[str, tuple[str, str | None, str | None]]] = {}
+
+    for message in data.messages:
+        if isinstance(message, MemberEvent):
+            user_id = message.state_key
+            current = member_state(message)
+            previous = members.get(user_id)
+            pending = pending_leaves.pop(user_id, None)
+
+            if (
+                pending is not None
+                and message.sender == user_id
+                and current[0] == "join"
+                and history_visibility in FLAP_HISTORY_VISIBILITIES
+            ):
+                leave_event_id, before_leave = pending
+                elided.add(leave_event_id)
+                stats.membership_flaps += 1
+                members[user_id] = current
+                if current == before_leave:
+                    elided.add(message.event_id)
+                continue
+
+            if current == previous:
+                elided.add(message.event_id)
+                stats.noop_member += 1
+                continue
+
+            if (
+                current[0] == "leave"
+                and message.sender == user_id
+                and previous is not None
+                and previous[0] == "join"
+                and history_visibility in FLAP_HISTORY_VISIBILITIES
+            ):
+                pending_leaves[user_id] = (message.event_id, previous)
+            members[user_id] = current
+
+        elif isinstance(message, REPLAYED_STATE_EVENTS):
+            key = (message.type, message.state_key)
+            content = message.content.model_dump(exclude_none=True)
+            if state.get(key) == content:
+                elided.add(message.event_id)
+                stats.noop_state += 1
+                continue
+            state[key] = content
+            if isinstance(message, HistoryVisibilityEvent):
+                history_visibility = message.content.history_visibility
+
+    return elided, stats
+
+
+@dataclass
+class EventCompactionStats:
+    folded_edits: int = 0
+    redacted_events: int = 0
+
+
+def compact_edits_and_redactions(
+    data: ExportFile,
+) -> tuple[set[str], EventCompactionStats]:
+    stats = EventCompactionStats()
+    skipped: set[str] = set()
+    seen_event_ids: set[str] = set()
+
+    for message in data.messages:
+        if isinstance(message, RedactionEvent):
+            redacted_event_id = message.redacted_event_id
+            if redacted_event_id in seen_event_ids and redacted_event_id not in skipped:
+                skipped.add(redacted_event_id)
+                skipped.add(message.event_id)
+                stats.redacted_events += 1
+        seen_event_ids.add(message.event_id)
+
+    originals: dict[str, MessageEvent] = {}
+    # edit event id -> original event id, so that references can be remapped.
+    edit_aliases: dict[str, str] = {}
+    for message in data.messages:
+        if not isinstance(message, MessageEvent):
+            continue
+        relates_to = message.content.relates_to
+        if relates_to is None or relates_to.rel_type != "m.replace":
+            originals[message.event_id] = message
+            continue
+        original = originals.get(relates_to.event_id or "")
+        if original is None or original.sender != message.sender:
+            continue
+        if original.event_id in skipped:
+            skipped.add(message.event_id)
+            continue
+        if message.event_id in skipped or message.content.new_content is None:
+            continue
+        try:
+            new_content = MessageContent.model_validate(message.content.new_content)
+        except ValidationError:
+            continue
+        skipped.add(message.event_id)
+        edit_aliases[message.event_id] = original.event_id
+        new_content.relates_to = original.content.relates_to
+        original.content = new_content
+        stats.folded_edits += 1
+
+    for message in data.messages:
+        if not isinstance(message, (MessageEvent, ReactionEvent)):
+            continue
+        relates_to = message.content.relates_to
+        if relates_to is None:
+            continue
+        if relates_to.event_id is not None:
+            relates_to.event_id = edit_aliases.get(
+                relates_to.event_id, relates_to.event_id
+            )
+        if relates_to.in_reply_to is not None:
+            relates_to.in_reply_to.event_id = edit_aliases.get(
+                relates_to.in_reply_to.event_id, relates_to.in_reply_to.event_id
+            )
+
+    return skipped, stats
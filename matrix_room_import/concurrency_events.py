@@ -1,6 +1,24 @@
-from asyncio import Semaphore
+from asyncio import Queue, Semaphore
+from dataclasses import dataclass, field
 
 
 class SyncTaskSems:
     def __init__(self, initial_processes: int = 0):
         self.num_export_process_sem = Semaphore(initial_processes)
+        # keys of the downloads store to start.
+        self.pending_downloads: Queue[int] = Queue()
+
+
+# Counters of the appservice server, served by the stats endpoint.
+@dataclass
+class ServerStats:
+    # room id -> events of the room waiting or being handled.
+    lane_depths: dict[str, int] = field(default_factory=dict)
+    max_lane_depth: int = 0
+    events_handled: int = 0
+    events_received: int = 0
+    # events dropped before validation, that no handler acts upon, among them
+    # the echoes of the replay of imports.
+    events_filtered: int = 0
+    # messages sent by the bot coming back to the appservice.
+    echoes_suppressed: int = 0
@@ -29,9 +29,43 @@ class Config(BaseModel):
 
     space_id: str | None = None
 
+    compact_state_events: bool = False
+    compact_edits_and_redactions: bool = False
+
+    parse_workers: int = 2
+    parse_cache: bool = True
+
+    reaction_concurrency: int = 8
+    reaction_retries: int = 3
+
+    import_dir_parallelism: int = 2
+
+    download_concurrency: int = 2
+    download_retries: int = 5
+
+    room_lane_concurrency: int = 4
+
+    source_homeserver_url: str | None = None
+    source_access_token: str | None = None
+    source_page_size: int = 1000
+
+    transfer_media: bool = False
+    media_transfer_concurrency: int = 4
+
+    rewrite_server_names: dict[str, str] = Field(default_factory=dict)
+    rewrite_user_ids: dict[str, str] = Field(default_factory=dict)
+
     database_location: str
 
 
+# Parsed exports are cached next to the database, out of the directories
+# exports are dropped in.
+def parse_cache_dir(config: Config) -> Path | None:
+    if not config.parse_cache:
+        return None
+    return (PROJECT_DIR / config.database_location).parent / "parse_cache"
+
+
 def load_config() -> Config:
     default_config_path = PROJECT_DIR / "example-config.yaml"
     config_path = PROJECT_DIR / "config.yaml"
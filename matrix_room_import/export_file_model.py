@@ -1,11 +1,14 @@
 from collections.abc import Sequence
-from logging import info
 from typing import Annotated, Any, Literal
 
-from pydantic import BaseModel, Discriminator, Field, Tag
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 
-from matrix_room_import import LOGGER
-from matrix_room_import.appservice.types import Mentions, MsgType, RelatesTo
+from matrix_room_import.appservice.types import (
+    Mentions,
+    MsgType,
+    PowerLevelContent,
+    RelatesTo,
+)
 
 
 class EventBase(BaseModel):
@@ -18,10 +21,21 @@ class EventBase(BaseModel):
     user_id: str | None = None
 
 
+# Top-level fields of the first message of an export, read to group the parts
+# of a room before they are parsed.
+class EventHead(BaseModel):
+    room_id: str
+
+
 class StateEventBase(EventBase):
     state_key: str
 
 
+class CreateEvent(StateEventBase):
+    type: Literal["m.room.create"]
+    content: Any
+
+
 class MemberContent(BaseModel):
     membership: str
     displayname: str | None = None
@@ -90,6 +104,11 @@ class TopicEvent(StateEventBase):
     content: TopicContent
 
 
+class PowerLevelsEvent(StateEventBase):
+    type: Literal["m.room.power_levels"]
+    content: PowerLevelContent
+
+
 class MessageContent(BaseModel):
     msgtype: MsgType
     body: str
@@ -97,8 +116,10 @@ class MessageContent(BaseModel):
     formatted_body: Any | None = None
     mentions: Mentions | None = Field(alias="m.mentions", default=None)
     file: Any | None = None
+    url: str | None = None
     info: dict[str, Any] = Field(default_factory=dict)
     relates_to: RelatesTo | None = Field(alias="m.relates_to", default=None)
+    new_content: dict[str, Any] | None = Field(alias="m.new_content", default=None)
 
 
 class MessageEvent(EventBase):
@@ -111,12 +132,27 @@ class ReactionContent(BaseModel):
 
 
 class ReactionEvent(EventBase):
-    type: Literal["m.room.reaction"]
+    type: Literal["m.reaction"]
     content: ReactionContent
 
 
+class RedactionContent(BaseModel):
+    redacts: str | None = None
+    reason: str | None = None
+
+
+class RedactionEvent(EventBase):
+    type: Literal["m.room.redaction"]
+    redacts: str | None = None
+    content: RedactionContent
+
+    @property
+    def redacted_event_id(self) -> str | None:
+        return self.content.redacts or self.redacts
+
+
 class SkippedEvent(EventBase):
-    type: str
+    type: Literal["m.room.encrypted"]
     content: Any
 
 
@@ -124,6 +160,13 @@ class GenericEvent(EventBase):
     type: str
     content: Any
 
+    @field_validator("type")
+    @classmethod
+    def unknown_type_validation(cls, value: str) -> str:
+        if value in KNOWN_EVENT_TYPES:
+            raise ValueError(f"invalid event of type {value}")
+        return value
+
 
 class SpaceChildContent(BaseModel):
     via: Sequence[str]
@@ -136,51 +179,46 @@ class SpaceChildEvent(StateEventBase):
     content: SpaceChildContent
 
 
-skipped_event_types = ["m.room.encrypted"]
-
-event_types = [
-    "m.room.member",
-    "m.room.encryption",
-    "m.space.child",
-    "m.room.reaction",
-    "m.room.message",
-    "m.room.topic",
-    "m.room.name",
-    "m.room.history_visibility",
-    "m.room.join_rules",
-    "m.room.guest_access",
-    "m.room.encryption",
-    "__default__",
+# Events of known types are selected by the `type` tag, any other type falls
+# back to GenericEvent.
+KnownEvent = Annotated[
+    CreateEvent
+    | MemberEvent
+    | EncryptionEvent
+    | GuestAccessEvent
+    | JoinRulesEvent
+    | HistoryVisibilityEvent
+    | RoomNameEvent
+    | TopicEvent
+    | PowerLevelsEvent
+    | SpaceChildEvent
+    | MessageEvent
+    | ReactionEvent
+    | RedactionEvent
+    | SkippedEvent,
+    Field(discriminator="type"),
 ]
 
-
-def get_event_type(event_type) -> str:
-    if isinstance(event_type, dict):
-        t = event_type.get("type", "__default__")
-    else:
-        t = getattr(event_type, "type", "__default__")
-    if t in skipped_event_types:
-        return "__skipped__"
-    if t in event_types:
-        return t
-    return "__default__"
-
-
-Event = Annotated[
-    Annotated[MemberEvent, Tag("m.room.member")]
-    | Annotated[EncryptionEvent, Tag("m.room.encryption")]
-    | Annotated[GuestAccessEvent, Tag("m.room.guest_access")]
-    | Annotated[JoinRulesEvent, Tag("m.room.join_rules")]
-    | Annotated[HistoryVisibilityEvent, Tag("m.room.history_visibility")]
-    | Annotated[RoomNameEvent, Tag("m.room.name")]
-    | Annotated[TopicEvent, Tag("m.room.topic")]
-    | Annotated[SpaceChildEvent, Tag("m.space.child")]
-    | Annotated[MessageEvent, Tag("m.room.message")]
-    | Annotated[ReactionEvent, Tag("m.room.reaction")]
-    | Annotated[SkippedEvent, Tag("__skipped__")]
-    | Annotated[GenericEvent, Tag("__default__")],
-    Discriminator(get_event_type),
-]
+KNOWN_EVENT_TYPES = frozenset(
+    [
+        "m.room.create",
+        "m.room.member",
+        "m.room.encryption",
+        "m.room.guest_access",
+        "m.room.join_rules",
+        "m.room.history_visibility",
+        "m.room.name",
+        "m.room.topic",
+        "m.room.power_levels",
+        "m.space.child",
+        "m.room.message",
+        "m.reaction",
+        "m.room.redaction",
+        "m.room.encrypted",
+    ]
+)
+
+Event = Annotated[KnownEvent | GenericEvent, Field(union_mode="left_to_right")]
 
 
 class ExportFile(BaseModel):
@@ -190,3 +228,6 @@ class ExportFile(BaseModel):
     export_date: str
     exported_by: str
     messages: list[Event]
+
+
+export_file_adapter = TypeAdapter(ExportFile)
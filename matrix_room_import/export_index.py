@@ -0,0 +1,47 @@
+from dataclasses import dataclass, field
+
+from matrix_room_import.export_file_model import (
+    ExportFile,
+    MessageEvent,
+    RedactionEvent,
+)
+from matrix_room_import.state_planner import InitialStatePlan, InitialStatePlanner
+
+
+@dataclass
+class ExportIndex:
+    room_id: str
+    initial_state: InitialStatePlan
+    last_event_id: str
+    last_ts: int
+    mimetypes: dict[str, str] = field(default_factory=dict)
+    redacted_event_ids: set[str] = field(default_factory=set)
+
+
+def build_export_index(data: ExportFile) -> ExportIndex:
+    if len(data.messages) == 0:
+        raise ValueError("No message with room_id.")
+
+    planner = InitialStatePlanner(data.room_name, data.room_creator)
+    mimetypes: dict[str, str] = {}
+    redacted_event_ids: set[str] = set()
+
+    for message in data.messages:
+        planner.add(message)
+
+        if isinstance(message, MessageEvent):
+            mimetype = message.content.info.get("mimetype", None)
+            if mimetype is not None:
+                mimetypes[message.content.body] = mimetype
+        elif isinstance(message, RedactionEvent):
+            if message.redacted_event_id is not None:
+                redacted_event_ids.add(message.redacted_event_id)
+
+    return ExportIndex(
+        room_id=data.messages[0].room_id,
+        initial_state=planner.plan(),
+        last_event_id=data.messages[-1].event_id,
+        last_ts=data.messages[-1].origin_server_ts,
+        mimetypes=mimetypes,
+        redacted_event_ids=redacted_event_ids,
+    )
@@ -0,0 +1,418 @@
+import bz2
+import gc
+import gzip
+import hashlib
+import heapq
+import json
+import lzma
+import os
+import re
+from collections.abc import Callable, Generator, Iterator, Sequence
+from dataclasses import dataclass, replace
+from itertools import islice
+from pathlib import Path
+from typing import IO, cast, overload
+from zipfile import BadZipFile, ZipFile
+
+from pydantic import TypeAdapter
+
+from matrix_room_import import LOGGER
+from matrix_room_import.compaction import (
+    compact_edits_and_redactions,
+    compact_state_events,
+)
+from matrix_room_import.export_file_model import (
+    Event,
+    EventHead,
+    ExportFile,
+    export_file_adapter,
+)
+from matrix_room_import.export_index import ExportIndex, build_export_index
+from matrix_room_import.id_rewriter import IdRewriter
+from matrix_room_import.import_plan import ImportPlan, compile_plan
+from matrix_room_import.replay_events import to_replay_events
+
+# Decompressors of compressed JSON exports, they decompress while reading.
+COMPRESSIONS: dict[str, Callable[[IO[bytes]], IO[bytes]]] = {
+    # GzipFile is not typed as an IO[bytes], unlike LZMAFile and BZ2File.
+    ".gz": lambda f: cast(IO[bytes], gzip.GzipFile(fileobj=f)),
+    ".xz": lzma.LZMAFile,
+    ".bz2": bz2.BZ2File,
+}
+EXPORT_JSON_NAMES = ["export.json", *(f"export.json{c}" for c in COMPRESSIONS)]
+EXPORT_SUFFIXES = [".zip", ".json", *(f".json{c}" for c in COMPRESSIONS)]
+
+# Errors of reading a damaged export: I/O and decompression errors, and JSON
+# that does not validate.
+PARSE_ERRORS = (OSError, EOFError, ValueError, BadZipFile, lzma.LZMAError)
+
+# Bump when the parsed representation changes to invalidate cached parses.
+PARSER_VERSION = 8
+
+MESSAGES_PATTERN = re.compile(r'"messages"\s*:\s*\[\s*')
+# The first message of an export comes right after its few header fields.
+SNIFF_SIZE = 1 << 16
+
+
+def get_filename(name: str):
+    parts = name.split(".")
+    ext = parts[-1]
+    stem = ".".join(parts[:-1])
+    stem_parts = " at ".join(stem.split(" at ")[:-1]).split("-")[:-3]
+    return "-".join(stem_parts) + "." + ext
+
+
+def is_export(path: Path) -> bool:
+    return any(path.name.endswith(suffix) for suffix in EXPORT_SUFFIXES)
+
+
+def decompressed(name: str, f: IO[bytes]) -> IO[bytes]:
+    for suffix, decompressor in COMPRESSIONS.items():
+        if name.endswith(suffix):
+            return decompressor(f)
+    return f
+
+
+def load_export_file(file_path: Path) -> ExportFile:
+    with (
+        open(file_path, "rb") as f,
+        decompressed(file_path.name, f) as export_file,
+    ):
+        data = export_file_adapter.validate_json(export_file.read())
+    return data
+
+
+# Attachment of a zip export, read from the archive when it is uploaded rather
+# than held in memory (and sent back from the parsing process).
+@dataclass(frozen=True, slots=True)
+class Attachment:
+    archive: Path
+    name: str
+    size: int
+    # index of the archive in the parts of the export, to find it again when
+    # the parse is loaded from the cache.
+    part: int = 0
+
+
+def load_zip_export(
+    zip_path: Path,
+) -> tuple[ExportFile | None, dict[str, Attachment]]:
+    files: dict[str, Attachment] = {}
+    data: ExportFile | None = None
+    with ZipFile(zip_path) as zip:
+        for info in zip.infolist():
+            name = info.filename
+            filepath = name.split("/")
+            if len(filepath) < 2:
+                continue
+            if filepath[1] in EXPORT_JSON_NAMES:
+                with (
+                    zip.open(name) as f,
+                    decompressed(name, f) as export_file,
+                ):
+                    data = export_file_adapter.validate_json(export_file.read())
+            elif (
+                filepath[1] in ["images", "files"]
+                and len(filepath) > 2
+                and filepath[2] != ""
+            ):
+                filename = get_filename(filepath[2])
+                files[filename] = Attachment(zip_path, name, info.file_size)
+            else:
+                print(f"skipped {name}")
+
+    return data, files
+
+
+def read_attachment(
+    attachment: Attachment, chunk_size: int = 1 << 20
+) -> Generator[bytes, None, None]:
+    with ZipFile(attachment.archive) as zip, zip.open(attachment.name) as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def load_export(path: Path) -> tuple[ExportFile | None, dict[str, Attachment]]:
+    if path.suffix == ".zip":
+        return load_zip_export(path)
+    return load_export_file(path), {}
+
+
+# Room id of the first message of an export, read without parsing the export,
+# to find the parts of a room exported in several files.
+def sniff_room_id(path: Path) -> str | None:
+    try:
+        if path.suffix == ".zip":
+            with ZipFile(path) as zip:
+                for name in zip.namelist():
+                    if name.split("/")[1:2] in ([n] for n in EXPORT_JSON_NAMES):
+                        with (
+                            zip.open(name) as f,
+                            decompressed(name, f) as export_file,
+                        ):
+                            head = export_file.read(SNIFF_SIZE)
+                        break
+                else:
+                    return None
+        else:
+            with open(path, "rb") as f, decompressed(path.name, f) as export_file:
+                head = export_file.read(SNIFF_SIZE)
+    except (OSError, EOFError, BadZipFile, lzma.LZMAError):
+        return None
+    # the head may end within a character or within the first message.
+    text = head.decode(errors="ignore")
+    match = MESSAGES_PATTERN.search(text)
+    if match is None:
+        return None
+    try:
+        message, _ = json.JSONDecoder().raw_decode(text, match.end())
+        return EventHead.model_validate(message).room_id
+    except ValueError:
+        return None
+
+
+# Events of the parts in chronological order, events exported in several
+# parts are kept once.
+def merge_parts(parts: Sequence[ExportFile]) -> Iterator[Event]:
+    seen_event_ids: set[str] = set()
+    for message in heapq.merge(
+        *(part.messages for part in parts), key=lambda m: m.origin_server_ts
+    ):
+        if message.event_id not in seen_event_ids:
+            seen_event_ids.add(message.event_id)
+            yield message
+
+
+# Merged events of several parts, merged again on each pass of the compiler
+# over them instead of being copied into a single list.
+class MergedMessages(Sequence[Event]):
+    def __init__(self, parts: Sequence[ExportFile]):
+        self.parts = parts
+        self.length: int | None = None
+
+    def __iter__(self) -> Iterator[Event]:
+        return merge_parts(self.parts)
+
+    def __len__(self) -> int:
+        if self.length is None:
+            self.length = sum(1 for _ in self)
+        return self.length
+
+    @overload
+    def __getitem__(self, i: int) -> Event: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> list[Event]: ...
+
+    def __getitem__(self, i: int | slice) -> Event | list[Event]:
+        if isinstance(i, slice):
+            return list(self)[i]
+        if i < 0:
+            i += len(self)
+        message = next(islice(self, i, None), None) if i >= 0 else None
+        if message is None:
+            raise IndexError(i)
+        return message
+
+
+def load_export_parts(
+    paths: Sequence[Path],
+) -> tuple[ExportFile | None, dict[str, Attachment]]:
+    parts: list[ExportFile] = []
+    files: dict[str, Attachment] = {}
+    for path in paths:
+        data, part_files = load_export(path)
+        if data is None:
+            continue
+        if (
+            parts
+            and data.messages
+            and parts[0].messages
+            and data.messages[0].room_id != parts[0].messages[0].room_id
+        ):
+            raise ValueError(f"{path} is not a part of the same room.")
+        files.update(
+            (filename, replace(attachment, part=len(parts)))
+            for filename, attachment in part_files.items()
+        )
+        parts.append(data)
+    if len(parts) <= 1:
+        return (parts[0] if parts else None), files
+    messages = MergedMessages(parts)
+    LOGGER.info("Merged %d parts into %d events", len(parts), len(messages))
+    return parts[0].model_copy(update={"messages": messages}), files
+
+
+# Result of `parse_export`, sent back from the parsing process.
+@dataclass
+class ParsedExport:
+    index: ExportIndex
+    plan: ImportPlan
+    files: dict[str, Attachment]
+    cache_path: Path | None = None
+
+
+# Parses are cached as JSON, a cache is only ever data to validate.
+parsed_export_adapter = TypeAdapter(ParsedExport)
+
+
+def export_sha256(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def parts_sha256(paths: Sequence[Path]) -> str:
+    if len(paths) == 1:
+        return export_sha256(paths[0])
+    sha256 = hashlib.sha256()
+    for path in paths:
+        sha256.update(export_sha256(path).encode())
+    return sha256.hexdigest()
+
+
+def parse_cache_path(
+    cache_dir: Path,
+    sha256: str,
+    compact_state: bool,
+    compact_edits: bool,
+    rewriter: IdRewriter | None = None,
+) -> Path:
+    flags = f"{int(compact_state)}{int(compact_edits)}"
+    if rewriter is not None:
+        flags += f".{rewriter.fingerprint}"
+    return cache_dir / f"{sha256}.v{PARSER_VERSION}.{flags}.json"
+
+
+def load_parse_cache(cache_path: Path) -> ParsedExport | None:
+    # the cache only holds acyclic objects, collecting during the load of
+    # millions of them would only slow it down.
+    gc.disable()
+    try:
+        with open(cache_path, "rb") as f:
+            return parsed_export_adapter.validate_json(f.read())
+    except (OSError, ValueError):
+        LOGGER.warning("Removing unreadable parse cache %s", cache_path, exc_info=True)
+        cache_path.unlink(missing_ok=True)
+        return None
+    finally:
+        gc.enable()
+
+
+# Caches are only useful until the export is imported, e.g. to retry an import
+# or after `mri plan`. Caches of other parser versions are removed with them.
+def evict_parse_cache(parsed: ParsedExport):
+    if parsed.cache_path is None:
+        return
+    sha256 = parsed.cache_path.name.split(".")[0]
+    for path in parsed.cache_path.parent.glob(f"{sha256}.v*.json"):
+        path.unlink(missing_ok=True)
+
+
+def write_parse_cache(cache_path: Path, parsed: ParsedExport):
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(parsed_export_adapter.dump_json(parsed))
+    os.replace(tmp_path, cache_path)
+
+
+def events_since(messages: Sequence[Event], event_id: str, ts: int) -> list[Event]:
+    for i, message in enumerate(messages):
+        if message.event_id == event_id:
+            return list(messages[i + 1 :])
+    # paged from the last imported event, or an export starting after it.
+    return [
+        message
+        for message in messages
+        if message.origin_server_ts >= ts and message.event_id != event_id
+    ]
+
+
+def compile_export(
+    data: ExportFile,
+    files: dict[str, Attachment],
+    compact_state: bool = False,
+    compact_edits: bool = False,
+    since_event_id: str | None = None,
+    since_ts: int = 0,
+    rewriter: IdRewriter | None = None,
+) -> ParsedExport:
+    index = build_export_index(data)
+    events = data.messages
+    skipped_event_ids: set[str] = set()
+    if since_event_id is None:
+        skipped_event_ids |= index.initial_state.folded_event_ids
+    else:
+        # Delta imports replay what follows the last imported event into the
+        # existing room. Compactions are not applied, they could fold a new
+        # event into an already imported one.
+        events = events_since(data.messages, since_event_id, since_ts)
+        compact_state = compact_edits = False
+    if compact_state:
+        elided_event_ids, compaction_stats = compact_state_events(data)
+        skipped_event_ids |= elided_event_ids
+        LOGGER.info("State compaction: %s", compaction_stats)
+    if compact_edits:
+        elided_event_ids, event_compaction_stats = compact_edits_and_redactions(data)
+        skipped_event_ids |= elided_event_ids
+        LOGGER.info("Event compaction: %s", event_compaction_stats)
+
+    plan = compile_plan(
+        index.initial_state,
+        to_replay_events(events),
+        skipped_event_ids,
+        index.redacted_event_ids,
+        {filename: attachment.size for filename, attachment in files.items()},
+        index.mimetypes,
+    )
+    if since_event_id is not None:
+        media = {operation.media for operation in plan.timeline}
+        plan.uploads = [upload for upload in plan.uploads if upload.media in media]
+    if rewriter is not None:
+        rewriter.rewrite_plan(plan)
+    return ParsedExport(index, plan, files)
+
+
+def parse_export(
+    path: Path | Sequence[Path],
+    compact_state: bool = False,
+    compact_edits: bool = False,
+    cache_dir: Path | None = None,
+    rewriter: IdRewriter | None = None,
+) -> ParsedExport | None:
+    # several paths are the parts of a single room.
+    paths = [path] if isinstance(path, Path) else list(path)
+    if cache_dir is not None:
+        cache_path = parse_cache_path(
+            cache_dir, parts_sha256(paths), compact_state, compact_edits, rewriter
+        )
+        if cache_path.exists():
+            parsed = load_parse_cache(cache_path)
+            if parsed is not None:
+                LOGGER.info("Loaded %s from parse cache", path)
+                parsed.cache_path = cache_path
+                parsed.files = {
+                    filename: replace(attachment, archive=paths[attachment.part])
+                    for filename, attachment in parsed.files.items()
+                }
+                return parsed
+
+    data, files = load_export_parts(paths)
+    if data is None:
+        return None
+
+    parsed = compile_export(
+        data, files, compact_state, compact_edits, rewriter=rewriter
+    )
+    # keys of encrypted attachments are never written to disk.
+    if cache_dir is not None and not parsed.plan.encrypted_files:
+        try:
+            write_parse_cache(cache_path, parsed)
+        except OSError:
+            LOGGER.warning("Could not write parse cache %s", cache_path, exc_info=True)
+        else:
+            parsed.cache_path = cache_path
+    return parsed
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import re
+from collections.abc import Mapping
+from typing import Any
+from urllib.parse import quote, unquote
+
+from matrix_room_import.config import Config
+from matrix_room_import.import_plan import ImportPlan, Operation
+
+# Characters that cannot be part of the localpart of an id written in a body,
+# a pill or a matrix.to link.
+LOCALPART = r"[^\s:/\"'<>%&?#@]+"
+
+MAX_ID_LENGTH = 255
+# rewritten ids kept at most, the memo starts over past it.
+MAX_MEMOIZED_IDS = 100_000
+
+
+# Rewrites user ids and room aliases of the source homeserver, plain or url
+# encoded, with a single regex built from every mapped server name.
+class IdRewriter:
+    def __init__(
+        self,
+        server_names: Mapping[str, str],
+        user_ids: Mapping[str, str] | None = None,
+    ):
+        self.server_names = dict(server_names)
+        self.user_ids = dict(user_ids or {})
+        self.ids: dict[str, str] = {}
+        servers = {*self.server_names}
+        servers.update(user_id.partition(":")[2] for user_id in self.user_ids)
+        # longest first, so that a server name does not match a prefix of
+        # another one.
+        alternation = (
+            "|".join(
+                re.escape(server) for server in sorted(servers, key=len, reverse=True)
+            )
+            or "(?!)"
+        )
+        self.pattern = re.compile(
+            rf"(@|#|%40|%23)({LOCALPART})(:|%3[Aa])({alternation})(?![\w.-])"
+        )
+        self.fingerprint = hashlib.sha256(
+            json.dumps([self.server_names, self.user_ids], sort_keys=True).encode()
+        ).hexdigest()[:12]
+
+    def __bool__(self) -> bool:
+        return bool(self.server_names or self.user_ids)
+
+    def _replace(self, match: re.Match[str]) -> str:
+        sigil, localpart, separator, server = match.groups()
+        encoded = separator != ":"
+        if sigil in ("@", "%40"):
+            new_user_id = self.user_ids.get(f"@{unquote(localpart)}:{server}")
+            if new_user_id is not None:
+                return quote(new_user_id, safe="") if encoded else new_user_id
+        return f"{sigil}{localpart}{separator}{self.server_names.get(server, server)}"
+
+    def rewrite(self, value: str) -> str:
+        # most strings of an event (keys, event ids, msgtypes) hold no id.
+        if ":" not in value and "%3" not in value:
+            return value
+        # ids are rewritten over and over (senders, state keys, mentions).
+        if len(value) <= MAX_ID_LENGTH and " " not in value:
+            rewritten = self.ids.get(value)
+            if rewritten is None:
+                if len(self.ids) >= MAX_MEMOIZED_IDS:
+                    self.ids.clear()
+                rewritten = self.ids[value] = self.pattern.sub(self._replace, value)
+            return rewritten
+        return self.pattern.sub(self._replace, value)
+
+    def rewrite_content(self, content: Any) -> Any:
+        if isinstance(content, str):
+            return self.rewrite(content)
+        if isinstance(content, dict):
+            # keys hold user ids too, e.g. in power levels.
+            return {
+                self.rewrite(key): self.rewrite_content(value)
+                for key, value in content.items()
+            }
+        if isinstance(content, list):
+            return [self.rewrite_content(value) for value in content]
+        return content
+
+    def rewrite_operation(self, operation: Operation):
+        if operation.user_id is not None:
+            operation.user_id = self.rewrite(operation.user_id)
+        if operation.state_key is not None:
+            operation.state_key = self.rewrite(operation.state_key)
+        if operation.content is not None:
+            operation.content = self.rewrite_content(operation.content)
+
+    # `users_in_room` is left untouched, it lists the users of the old room.
+    # The ids of a room are memoized while rewriting its plan only.
+    def rewrite_plan(self, plan: ImportPlan):
+        for operation in plan.operations():
+            self.rewrite_operation(operation)
+        self.ids.clear()
+
+
+def get_id_rewriter(config: Config) -> IdRewriter | None:
+    rewriter = IdRewriter(config.rewrite_server_names, config.rewrite_user_ids)
+    return rewriter if rewriter else None
@@ -0,0 +1,301 @@
+import json
+from collections import Counter
+from collections.abc import Iterable, Iterator, Mapping
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Any
+
+from pydantic import ValidationError
+
+from matrix_room_import import LOGGER
+from matrix_room_import.appservice.types import ImageInfo, RoomMessage
+from matrix_room_import.export_file_model import MemberContent
+from matrix_room_import.replay_events import EventKind, ReplayEvent
+from matrix_room_import.state_planner import InitialStatePlan
+
+
+class OperationKind(str, Enum):
+    upload_media = "upload_media"
+    transfer_media = "transfer_media"
+    create_room = "create_room"
+    send_state = "send_state"
+    send_event = "send_event"
+    redact = "redact"
+    send_reaction = "send_reaction"
+
+
+# Number of homeserver requests made by each operation.
+OPERATION_REQUESTS = {
+    OperationKind.upload_media: 2,
+    OperationKind.transfer_media: 3,
+    OperationKind.create_room: 1,
+    OperationKind.send_state: 1,
+    OperationKind.send_event: 1,
+    OperationKind.redact: 1,
+    OperationKind.send_reaction: 1,
+}
+
+
+# One outgoing operation of an import. Relations in `content` still point to
+# source event ids, they are remapped when the operation is executed.
+@dataclass(slots=True)
+class Operation:
+    kind: OperationKind
+    event_id: str | None = None
+    type: str | None = None
+    user_id: str | None = None
+    ts: int | None = None
+    state_key: str | None = None
+    content: dict[str, Any] | None = None
+    # attachment filename uploaded by `upload_media`, or source mxc url copied
+    # by `transfer_media`, used as the url of the `send_event` operation.
+    media: str | None = None
+    size: int = 0
+
+    def to_json(self) -> dict[str, Any]:
+        data: dict[str, Any] = {"kind": self.kind.value}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if name != "kind" and value is not None and value != 0:
+                data[name] = value
+        return data
+
+
+@dataclass
+class ImportPlan:
+    create_room: Operation
+    uploads: list[Operation] = field(default_factory=list)
+    timeline: list[Operation] = field(default_factory=list)
+    users_in_room: list[str] = field(default_factory=list)
+    # keys of the encrypted attachments to transfer, by media. They are kept
+    # out of the operations so that plans never hold them.
+    encrypted_files: dict[str, Any] = field(default_factory=dict)
+
+    def operations(self) -> Iterator[Operation]:
+        yield from self.uploads
+        yield self.create_room
+        yield from self.timeline
+
+
+class PlanCompiler:
+    def __init__(
+        self,
+        skipped_event_ids: set[str],
+        redacted_event_ids: set[str],
+        attachments: Mapping[str, int],
+    ):
+        self.skipped_event_ids = skipped_event_ids
+        self.redacted_event_ids = redacted_event_ids
+        self.attachments = attachments
+        self.users_in_room: list[str] = []
+        self.encrypted_files: dict[str, Any] = {}
+
+    def compile(self, events: Iterable[ReplayEvent]) -> Iterator[Operation]:
+        for message in events:
+            if message.kind == EventKind.member:
+                if message.content.membership == "join":
+                    self.users_in_room.append(message.sender)
+                elif (
+                    message.content.membership in ["leave", "ban"]
+                    and message.sender in self.users_in_room
+                ):
+                    self.users_in_room.remove(message.sender)
+
+            if message.event_id in self.skipped_event_ids:
+                continue
+
+            operation = self.compile_event(message)
+            if operation is not None:
+                yield operation
+
+    # Attachments of the export are uploaded, messages of exports without
+    # attachments keep their source url to be transferred. Exported attachments
+    # of encrypted rooms are already decrypted, the others are decrypted when
+    # transferred.
+    def media_of(self, message: ReplayEvent) -> str | None:
+        content = message.content
+        if (
+            content.info.get("mimetype", None) is not None
+            and content.body in self.attachments
+        ):
+            return content.body
+        if content.url is not None and content.url.startswith("mxc://"):
+            return content.url
+        if isinstance(content.file, dict) and str(
+            content.file.get("url", "")
+        ).startswith("mxc://"):
+            return content.file["url"]
+        return None
+
+    def compile_event(self, message: ReplayEvent) -> Operation | None:
+        operation = Operation(
+            OperationKind.send_event,
+            event_id=message.event_id,
+            type=message.type,
+            user_id=message.sender,
+            ts=message.ts,
+        )
+        try:
+            if message.kind == EventKind.member:
+                operation.kind = OperationKind.send_state
+                operation.state_key = message.state_key
+                operation.content = MemberContent(
+                    membership=message.content.membership,
+                    displayname=message.content.displayname,
+                    avatar_url=message.content.avatar_url,
+                ).model_dump(exclude_defaults=True, by_alias=True)
+            elif message.kind == EventKind.state:
+                operation.kind = OperationKind.send_state
+                operation.state_key = message.state_key
+                operation.content = message.content.model_dump(
+                    exclude_none=True, by_alias=True
+                )
+            elif (
+                message.kind == EventKind.message
+                and (media := self.media_of(message)) is not None
+            ):
+                info = message.content.info
+                operation.media = media
+                operation.content = RoomMessage(
+                    msgtype=message.content.msgtype,
+                    body=message.content.body,
+                    url="",
+                    info=ImageInfo(
+                        h=info.get("h", None),
+                        mimetype=info.get("mimetype", None),
+                        size=info.get("size", None),
+                        w=info.get("w", None),
+                    ),
+                    mentions=message.content.mentions,
+                    relates_to=message.content.relates_to,
+                ).model_dump(by_alias=True, exclude_defaults=True)
+                if media == (message.content.file or {}).get("url"):
+                    self.encrypted_files[media] = message.content.file
+            elif message.kind == EventKind.message and message.content.file is None:
+                operation.content = RoomMessage(
+                    msgtype=message.content.msgtype,
+                    body=message.content.body,
+                    format=message.content.format,
+                    formatted_body=message.content.formatted_body,
+                    mentions=message.content.mentions,
+                    relates_to=message.content.relates_to,
+                    new_content=message.content.new_content,
+                ).model_dump(by_alias=True, exclude_defaults=True)
+            elif message.kind == EventKind.redaction:
+                if message.content.redacts is None:
+                    return None
+                operation.kind = OperationKind.redact
+                operation.content = message.content.model_dump(exclude_none=True)
+            elif message.kind == EventKind.reaction:
+                relates_to = message.content.relates_to
+                if (
+                    message.event_id in self.redacted_event_ids
+                    or relates_to is None
+                    or relates_to.event_id is None
+                ):
+                    return None
+                operation.kind = OperationKind.send_reaction
+                operation.content = {
+                    "m.relates_to": {
+                        "rel_type": "m.annotation",
+                        "event_id": relates_to.event_id,
+                        "key": relates_to.key,
+                    }
+                }
+            elif message.kind == EventKind.generic and isinstance(
+                message.content, dict
+            ):
+                operation.content = RoomMessage(**message.content).model_dump(
+                    by_alias=True, exclude_defaults=True
+                )
+            else:
+                return None
+        except ValidationError as e:
+            LOGGER.warning("Cannot replay %s: %s", message.event_id, e)
+            return None
+        return operation
+
+
+def compile_plan(
+    initial_state: InitialStatePlan,
+    events: Iterable[ReplayEvent],
+    skipped_event_ids: set[str],
+    redacted_event_ids: set[str],
+    attachments: Mapping[str, int],
+    mimetypes: Mapping[str, str],
+) -> ImportPlan:
+    uploads = [
+        Operation(
+            OperationKind.upload_media,
+            media=filename,
+            content={"mimetype": mimetypes[filename]}
+            if filename in mimetypes
+            else None,
+            size=size,
+        )
+        for filename, size in attachments.items()
+    ]
+    create_room = Operation(
+        OperationKind.create_room,
+        user_id=initial_state.creator_id,
+        ts=initial_state.ts,
+        content=initial_state.body.model_dump(by_alias=True, exclude_defaults=True),
+    )
+    compiler = PlanCompiler(skipped_event_ids, redacted_event_ids, attachments)
+    timeline = list(compiler.compile(events))
+    transfers: dict[str, Operation] = {}
+    for operation in timeline:
+        if (
+            operation.media is not None
+            and operation.media not in compiler.attachments
+            and operation.media not in transfers
+        ):
+            info = (operation.content or {}).get("info", {})
+            mimetype = info.get("mimetype")
+            transfers[operation.media] = Operation(
+                OperationKind.transfer_media,
+                media=operation.media,
+                content={"mimetype": mimetype} if mimetype is not None else None,
+                size=info.get("size") or 0,
+            )
+    uploads.extend(transfers.values())
+    return ImportPlan(
+        create_room,
+        uploads,
+        timeline,
+        compiler.users_in_room,
+        compiler.encrypted_files,
+    )
+
+
+def write_plan(path: Path, plan: ImportPlan):
+    with open(path, "w") as f:
+        f.write(json.dumps({"users_in_room": plan.users_in_room}) + "\n")
+        f.writelines(
+            json.dumps(operation.to_json()) + "\n" for operation in plan.operations()
+        )
+
+
+@dataclass
+class PlanSummary:
+    requests: Counter[str] = field(default_factory=Counter)
+    upload_bytes: int = 0
+    users: set[str] = field(default_factory=set)
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.requests.values())
+
+    def duration(self, requests_per_second: float) -> float:
+        return self.total_requests / requests_per_second
+
+
+def summarize_plan(plan: ImportPlan) -> PlanSummary:
+    summary = PlanSummary()
+    for operation in plan.operations():
+        summary.requests[operation.kind.value] += OPERATION_REQUESTS[operation.kind]
+        summary.upload_bytes += operation.size
+        if operation.user_id is not None:
+            summary.users.add(operation.user_id)
+    return summary
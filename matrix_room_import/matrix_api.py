@@ -25,6 +25,10 @@ def whoami(hs_url: str, user_id: str) -> str:
     return sanitize_url(hs_url) + f"/_matrix/client/v3/account/whoami?{query}"
 
 
+def user_whoami(hs_url: str) -> str:
+    return sanitize_url(hs_url) + "/_matrix/client/v3/account/whoami"
+
+
 def profile(hs_url: str, user_id: str) -> str:
     return sanitize_url(hs_url) + f"/_matrix/client/v3/profile/{user_id}"
 
@@ -162,6 +166,25 @@ def get_room_state(
     return sanitize_url(hs_url) + f"/_matrix/client/v3/rooms/{room_id}/state?{query}"
 
 
+def get_event_context(
+    hs_url: str,
+    room_id: str,
+    event_id: str,
+    limit: int | None = None,
+    user_id: str | None = None,
+) -> str:
+    query_data: dict[str, str] = {}
+    if limit is not None:
+        query_data["limit"] = str(limit)
+    if user_id is not None:
+        query_data["user_id"] = user_id
+    query = urlencode(query_data)
+    return (
+        sanitize_url(hs_url)
+        + f"/_matrix/client/v3/rooms/{room_id}/context/{event_id}?{query}"
+    )
+
+
 def get_room_messages(
     hs_url: str,
     room_id: str,
@@ -0,0 +1,93 @@
+import sys
+from collections.abc import Iterable, Iterator
+from enum import IntEnum
+from typing import Any
+
+from matrix_room_import.export_file_model import (
+    Event,
+    GenericEvent,
+    MemberEvent,
+    MessageEvent,
+    ReactionEvent,
+    RedactionContent,
+    RedactionEvent,
+    StateEventBase,
+)
+from matrix_room_import.state_planner import REPLAYED_STATE_EVENTS
+
+
+class EventKind(IntEnum):
+    member = 0
+    state = 1
+    message = 2
+    redaction = 3
+    reaction = 4
+    generic = 5
+    skipped = 6
+
+
+# Compact form of an export event used by the replay: only the content model
+# needed for the outgoing body is kept, senders and types are interned.
+class ReplayEvent:
+    __slots__ = ("content", "event_id", "kind", "sender", "state_key", "ts", "type")
+
+    def __init__(
+        self,
+        event_id: str,
+        kind: EventKind,
+        type: str,
+        sender: str,
+        ts: int,
+        state_key: str | None,
+        content: Any,
+    ):
+        self.event_id = event_id
+        self.kind = kind
+        self.type = type
+        self.sender = sender
+        self.ts = ts
+        self.state_key = state_key
+        self.content = content
+
+    def __repr__(self) -> str:
+        return f"ReplayEvent({self.kind.name}, {self.type}, {self.event_id})"
+
+
+def event_kind(message: Event) -> EventKind:
+    if isinstance(message, MemberEvent):
+        return EventKind.member
+    if isinstance(message, REPLAYED_STATE_EVENTS):
+        return EventKind.state
+    if isinstance(message, MessageEvent):
+        return EventKind.message
+    if isinstance(message, RedactionEvent):
+        return EventKind.redaction
+    if isinstance(message, ReactionEvent):
+        return EventKind.reaction
+    if isinstance(message, GenericEvent):
+        return EventKind.generic
+    return EventKind.skipped
+
+
+def to_replay_event(message: Event) -> ReplayEvent:
+    content = message.content
+    if isinstance(message, RedactionEvent):
+        content = RedactionContent(
+            redacts=message.redacted_event_id, reason=message.content.reason
+        )
+    return ReplayEvent(
+        message.event_id,
+        event_kind(message),
+        sys.intern(message.type),
+        sys.intern(message.sender),
+        message.origin_server_ts,
+        message.state_key if isinstance(message, StateEventBase) else None,
+        content,
+    )
+
+
+# Converted as the plan is compiled, the export stays referenced until the
+# plan is done so a list of replay events would only add to the peak.
+def to_replay_events(messages: Iterable[Event]) -> Iterator[ReplayEvent]:
+    for message in messages:
+        yield to_replay_event(message)
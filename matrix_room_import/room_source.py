@@ -0,0 +1,94 @@
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime
+
+from pydantic import TypeAdapter, ValidationError
+
+from matrix_room_import import LOGGER
+from matrix_room_import.appservice.client import Client
+from matrix_room_import.appservice.types import ClientEvent, ErrorResponse
+from matrix_room_import.export_file_model import (
+    CreateEvent,
+    Event,
+    ExportFile,
+    RoomNameEvent,
+    TopicEvent,
+)
+
+event_adapter: TypeAdapter[Event] = TypeAdapter(Event)
+
+
+# Error response of the source homeserver while fetching a room.
+class SourceRoomError(Exception):
+    pass
+
+
+def to_export_event(event: ClientEvent) -> Event | None:
+    try:
+        return event_adapter.validate_python(event.model_dump())
+    except ValidationError as e:
+        LOGGER.warning("Cannot replay %s: %s", event.event_id, e)
+        return None
+
+
+async def page_room_events(
+    client: Client, room_id: str, page_size: int = 1000, from_: str | None = None
+) -> AsyncIterator[list[Event]]:
+    while True:
+        resp = await client.get_room_messages(
+            room_id, "f", from_=from_, limit=page_size
+        )
+        if isinstance(resp, ErrorResponse):
+            raise SourceRoomError(
+                f"Could not page {room_id}: {resp.errcode} - {resp.error}"
+            )
+        events = [
+            event for event in map(to_export_event, resp.chunk) if event is not None
+        ]
+        if events:
+            yield events
+        if resp.end is None or len(resp.chunk) == 0:
+            return
+        from_ = resp.end
+
+
+# Builds the same model as an Element export from the history of a room on
+# the source homeserver, so that it goes through the usual replay.
+async def fetch_room_history(
+    client: Client,
+    room_id: str,
+    page_size: int = 1000,
+    since_event_id: str | None = None,
+) -> ExportFile:
+    from_: str | None = None
+    if since_event_id is not None:
+        context = await client.get_event_context(room_id, since_event_id, limit=0)
+        if isinstance(context, ErrorResponse):
+            raise SourceRoomError(
+                f"Could not find {since_event_id} in {room_id}: "
+                f"{context.errcode} - {context.error}"
+            )
+        from_ = context.end
+
+    messages: list[Event] = []
+    room_creator = ""
+    room_name = room_id
+    topic = ""
+    async for events in page_room_events(client, room_id, page_size, from_):
+        for event in events:
+            if isinstance(event, CreateEvent) and not room_creator:
+                room_creator = event.sender
+            elif isinstance(event, RoomNameEvent) and event.content.name:
+                room_name = event.content.name
+            elif isinstance(event, TopicEvent):
+                topic = event.content.topic
+        messages.extend(events)
+        LOGGER.info("Fetched %d events of %s", len(messages), room_id)
+
+    return ExportFile(
+        room_name=room_name,
+        room_creator=room_creator,
+        topic=topic,
+        export_date=datetime.now(UTC).isoformat(),
+        exported_by=client.as_id,
+        messages=messages,
+    )
@@ -0,0 +1,119 @@
+from dataclasses import dataclass, field
+
+from matrix_room_import.appservice.types import (
+    CreateRoomBody,
+    CreationContent,
+    PowerLevelContent,
+    StateEvent,
+)
+from matrix_room_import.export_file_model import (
+    CreateEvent,
+    Event,
+    ExportFile,
+    GuestAccessEvent,
+    HistoryVisibilityEvent,
+    JoinRulesEvent,
+    MemberEvent,
+    PowerLevelsEvent,
+    RoomNameEvent,
+    StateEventBase,
+    TopicEvent,
+)
+
+INITIAL_STATE_EVENTS = (JoinRulesEvent, HistoryVisibilityEvent, GuestAccessEvent)
+
+# State events replayed with `send_state_event` when they could not be folded
+# into the createRoom call.
+REPLAYED_STATE_EVENTS = (
+    RoomNameEvent,
+    TopicEvent,
+    PowerLevelsEvent,
+    *INITIAL_STATE_EVENTS,
+)
+
+
+# Everything before the first timeline event is folded into the createRoom call,
+# folded events are then skipped by `populate_message`.
+@dataclass
+class InitialStatePlan:
+    body: CreateRoomBody
+    creator_id: str | None = None
+    ts: int | None = None
+    folded_event_ids: set[str] = field(default_factory=set)
+
+
+class InitialStatePlanner:
+    def __init__(self, room_name: str, room_creator: str):
+        self.room_name = room_name
+        self.room_creator = room_creator
+        self.creator_id: str | None = None
+        self.ts: int | None = None
+        self.name: str | None = None
+        self.topic: str | None = None
+        self.power_levels: PowerLevelContent | None = None
+        self.initial_state: dict[tuple[str, str], StateEvent] = {}
+        self.invites: list[str] = []
+        self.folded_event_ids: set[str] = set()
+        self.history_started = False
+
+    def add(self, message: Event):
+        # Element exports name the creator by display name, rooms paged from a
+        # homeserver by user id.
+        if (
+            self.creator_id is None
+            and isinstance(message, MemberEvent)
+            and self.room_creator in (message.content.displayname, message.sender)
+        ):
+            self.creator_id = message.sender
+            self.ts = message.origin_server_ts
+            self.folded_event_ids.add(message.event_id)
+            return
+
+        if self.history_started or not isinstance(message, StateEventBase):
+            self.history_started = True
+            return
+
+        if isinstance(message, CreateEvent):
+            self.folded_event_ids.add(message.event_id)
+        elif isinstance(message, RoomNameEvent):
+            self.name = message.content.name
+            self.folded_event_ids.add(message.event_id)
+        elif isinstance(message, TopicEvent):
+            self.topic = message.content.topic
+            self.folded_event_ids.add(message.event_id)
+        elif isinstance(message, PowerLevelsEvent):
+            self.power_levels = message.content
+            self.folded_event_ids.add(message.event_id)
+        elif isinstance(message, INITIAL_STATE_EVENTS):
+            self.initial_state[(message.type, message.state_key)] = StateEvent(
+                content=message.content,
+                state_key=message.state_key,
+                type=message.type,
+            )
+            self.folded_event_ids.add(message.event_id)
+        elif (
+            isinstance(message, MemberEvent)
+            and message.content.membership == "invite"
+            and message.sender == self.creator_id
+            and message.state_key not in self.invites
+        ):
+            self.invites.append(message.state_key)
+            self.folded_event_ids.add(message.event_id)
+
+    def plan(self) -> InitialStatePlan:
+        body = CreateRoomBody(
+            initial_state=list(self.initial_state.values()),
+            creation_content=CreationContent(federate=False),
+            name=self.name if self.name is not None else self.room_name,
+            topic=self.topic,
+            power_level_content_override=self.power_levels,
+            invite=self.invites or None,
+        )
+        return InitialStatePlan(body, self.creator_id, self.ts, self.folded_event_ids)
+
+
+def plan_initial_state(data: ExportFile) -> InitialStatePlan:
+    planner = InitialStatePlanner(data.room_name, data.room_creator)
+    for message in data.messages:
+        planner.add(message)
+    return planner.plan()
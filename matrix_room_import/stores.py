@@ -1,6 +1,7 @@
 import sqlite3
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from enum import Enum
 from os import PathLike
 from pathlib import Path
 from typing import Generic, TypeVar, cast
@@ -61,6 +62,7 @@ class DBStore(Store[_T]):
     def update(self, x: int, new_data: _T) -> None:
         if self.update_db(x, new_data):
             self.data[x] = new_data
+            return
         raise ValueError("index does not exist")
 
     @abstractmethod
@@ -193,6 +195,15 @@ class QueueStore(DBStore[Process]):
         k = next(iter(self.data.keys()))
         return self.pop(k)
 
+    def peek(self, n: int) -> list[tuple[int, Process]]:
+        return list(self.data.items())[:n]
+
+    def position(self, event_id: str) -> int | None:
+        for k, process in enumerate(self.data.values()):
+            if process.event_id == event_id:
+                return k + 1
+        return None
+
 
 @dataclass
 class RoomEvent:
@@ -260,6 +271,303 @@ class RoomsToRemoveStore(DBStore[RoomEvent]):
         raise ValueError("event_id not in db")
 
 
+class ImportStatus(str, Enum):
+    pending = "pending"
+    done = "done"
+    failed = "failed"
+
+
+@dataclass
+class ImportRecord:
+    sha256: str
+    status: ImportStatus
+    event_id: str
+    room_id: str
+    new_room_id: str | None = None
+
+
+class ImportsStore(DBStore[ImportRecord]):
+    def _load_data_query(self, cur: sqlite3.Cursor) -> sqlite3.Cursor:
+        return cur.execute(
+            "SELECT id, sha256, status, event_id, room_id, new_room_id FROM imports"
+        )
+
+    def _extract_db_data(self, cur: sqlite3.Cursor) -> dict[int, ImportRecord]:
+        return {
+            d[0]: ImportRecord(d[1], ImportStatus(d[2]), d[3], d[4], d[5]) for d in cur
+        }
+
+    def _insert_data_query(
+        self, cur: sqlite3.Cursor, data: ImportRecord
+    ) -> sqlite3.Cursor:
+        return cur.execute(
+            "INSERT INTO imports (sha256, status, event_id, room_id, new_room_id)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                data.sha256,
+                data.status.value,
+                data.event_id,
+                data.room_id,
+                data.new_room_id,
+            ),
+        )
+
+    def _update_data_query(
+        self, cur: sqlite3.Cursor, idx: int, data: ImportRecord
+    ) -> sqlite3.Cursor:
+        return cur.execute(
+            "UPDATE imports SET sha256=?, status=?, event_id=?, room_id=?,"
+            " new_room_id=? WHERE id=?",
+            (
+                data.sha256,
+                data.status.value,
+                data.event_id,
+                data.room_id,
+                data.new_room_id,
+                idx,
+            ),
+        )
+
+    def _delete_data_query(self, cur: sqlite3.Cursor, idx: int) -> sqlite3.Cursor:
+        return cur.execute("DELETE FROM imports WHERE id=?", (idx,))
+
+    def from_sha256(self, sha256: str) -> ImportRecord | None:
+        found: ImportRecord | None = None
+        for record in self.data.values():
+            if record.sha256 == sha256 and record.status != ImportStatus.failed:
+                found = record
+        return found
+
+    # the latest import of an event id, earlier ones are retried imports.
+    def from_event_id(self, event_id: str) -> tuple[int, ImportRecord] | None:
+        for k in reversed(self.data):
+            if self.data[k].event_id == event_id:
+                return k, self.data[k]
+        return None
+
+    def set_status(
+        self, event_id: str, status: ImportStatus, new_room_id: str | None = None
+    ):
+        found = self.from_event_id(event_id)
+        if found is not None:
+            k, record = found
+            self.update(k, replace(record, status=status, new_room_id=new_room_id))
+
+
+@dataclass
+class MigratedRoom:
+    source_room_id: str
+    target_room_id: str
+    last_event_id: str
+    last_ts: int
+
+
+class MigratedRoomsStore(DBStore[MigratedRoom]):
+    def _load_data_query(self, cur: sqlite3.Cursor) -> sqlite3.Cursor:
+        return cur.execute(
+            "SELECT id, source_room_id, target_room_id, last_event_id, last_ts"
+            " FROM migrated_rooms"
+        )
+
+    def _extract_db_data(self, cur: sqlite3.Cursor) -> dict[int, MigratedRoom]:
+        return {d[0]: MigratedRoom(d[1], d[2], d[3], d[4]) for d in cur}
+
+    def _insert_data_query(
+        self, cur: sqlite3.Cursor, data: MigratedRoom
+    ) -> sqlite3.Cursor:
+        return cur.execute(
+            "INSERT INTO migrated_rooms"
+            " (source_room_id, target_room_id, last_event_id, last_ts)"
+            " VALUES (?, ?, ?, ?)",
+            (
+                data.source_room_id,
+                data.target_room_id,
+                data.last_event_id,
+                data.last_ts,
+            ),
+        )
+
+    def _update_data_query(
+        self, cur: sqlite3.Cursor, idx: int, data: MigratedRoom
+    ) -> sqlite3.Cursor:
+        return cur.execute(
+            "UPDATE migrated_rooms SET source_room_id=?, target_room_id=?,"
+            " last_event_id=?, last_ts=? WHERE id=?",
+            (
+                data.source_room_id,
+                data.target_room_id,
+                data.last_event_id,
+                data.last_ts,
+                idx,
+            ),
+        )
+
+    def _delete_data_query(self, cur: sqlite3.Cursor, idx: int) -> sqlite3.Cursor:
+        return cur.execute("DELETE FROM migrated_rooms WHERE id=?", (idx,))
+
+    # latest migration of a source room, the one delta imports go to.
+    def from_source_room(self, room_id: str) -> tuple[int, MigratedRoom] | None:
+        found: tuple[int, MigratedRoom] | None = None
+        for k, room in self.data.items():
+            if room.source_room_id == room_id:
+                found = (k, room)
+        return found
+
+    def set_last_event(self, k: int, last_event_id: str, last_ts: int):
+        self.update(
+            k, replace(self.data[k], last_event_id=last_event_id, last_ts=last_ts)
+        )
+
+
+@dataclass
+class Upload:
+    upload_id: str
+    path: Path
+    size: int
+    user_id: str
+    room_id: str
+    event_id: str
+
+
+# Exports uploaded straight to the appservice, kept until they are complete so
+# that an interrupted upload can be resumed.
+class UploadsStore(DBStore[Upload]):
+    def _load_data_query(self, cur: sqlite3.Cursor) -> sqlite3.Cursor:
+        return cur.execute(
+            "SELECT id, upload_id, path, size, user_id, room_id, event_id FROM uploads"
+        )
+
+    def _extract_db_data(self, cur: sqlite3.Cursor) -> dict[int, Upload]:
+        return {d[0]: Upload(d[1], Path(d[2]), d[3], d[4], d[5], d[6]) for d in cur}
+
+    def _insert_data_query(self, cur: sqlite3.Cursor, data: Upload) -> sqlite3.Cursor:
+        return cur.execute(
+            "INSERT INTO uploads (upload_id, path, size, user_id, room_id, event_id)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                data.upload_id,
+                str(data.path),
+                data.size,
+                data.user_id,
+                data.room_id,
+                data.event_id,
+            ),
+        )
+
+    def _update_data_query(
+        self, cur: sqlite3.Cursor, idx: int, data: Upload
+    ) -> sqlite3.Cursor:
+        raise NotImplementedError()
+
+    def _delete_data_query(self, cur: sqlite3.Cursor, idx: int) -> sqlite3.Cursor:
+        return cur.execute("DELETE FROM uploads WHERE id=?", (idx,))
+
+    def from_upload_id(self, upload_id: str) -> tuple[int, Upload] | None:
+        for k, upload in self.data.items():
+            if upload.upload_id == upload_id:
+                return k, upload
+        return None
+
+
+@dataclass
+class Download:
+    url: str
+    path: Path
+    room_id: str
+    event_id: str
+
+
+# Exports sent in bot rooms that are still being downloaded, resumed from their
+# .part file after a restart.
+class DownloadsStore(DBStore[Download]):
+    def _load_data_query(self, cur: sqlite3.Cursor) -> sqlite3.Cursor:
+        return cur.execute("SELECT id, url, path, room_id, event_id FROM downloads")
+
+    def _extract_db_data(self, cur: sqlite3.Cursor) -> dict[int, Download]:
+        return {d[0]: Download(d[1], Path(d[2]), d[3], d[4]) for d in cur}
+
+    def _insert_data_query(self, cur: sqlite3.Cursor, data: Download) -> sqlite3.Cursor:
+        return cur.execute(
+            "INSERT INTO downloads (url, path, room_id, event_id) VALUES (?, ?, ?, ?)",
+            (data.url, str(data.path), data.room_id, data.event_id),
+        )
+
+    def _update_data_query(
+        self, cur: sqlite3.Cursor, idx: int, data: Download
+    ) -> sqlite3.Cursor:
+        raise NotImplementedError()
+
+    def _delete_data_query(self, cur: sqlite3.Cursor, idx: int) -> sqlite3.Cursor:
+        return cur.execute("DELETE FROM downloads WHERE id=?", (idx,))
+
+
+# Mappings are only needed by delta imports of a single room, they are not
+# kept in memory like the other stores.
+class EventMappingStore:
+    def __init__(self, conninfo: PathLike):
+        self.conninfo = conninfo
+
+    def load(self, target_room_id: str) -> dict[str, str]:
+        conn = sqlite3.connect(self.conninfo)
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT source_event_id, target_event_id FROM event_mappings"
+            " WHERE target_room_id=?",
+            (target_room_id,),
+        )
+        out = dict(cur.fetchall())
+        conn.close()
+        return out
+
+    def save(self, target_room_id: str, event_id_mapping: dict[str, str]):
+        conn = sqlite3.connect(self.conninfo)
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT OR REPLACE INTO event_mappings"
+            " (source_event_id, target_event_id, target_room_id) VALUES (?, ?, ?)",
+            (
+                (source_event_id, target_event_id, target_room_id)
+                for source_event_id, target_event_id in event_id_mapping.items()
+            ),
+        )
+        conn.commit()
+        conn.close()
+
+
+# Source mxc url -> target mxc url of the media already transferred, so that
+# media shared by several rooms or imports is only copied once.
+class MediaTransferStore:
+    def __init__(self, conninfo: PathLike):
+        self.conninfo = conninfo
+
+    def load(self, source_urls: list[str]) -> dict[str, str]:
+        conn = sqlite3.connect(self.conninfo)
+        cur = conn.cursor()
+        out: dict[str, str] = {}
+        # stay below the maximum number of sqlite parameters.
+        for i in range(0, len(source_urls), 500):
+            batch = source_urls[i : i + 500]
+            cur.execute(
+                "SELECT source_url, target_url FROM media_transfers"
+                f" WHERE source_url IN ({', '.join('?' * len(batch))})",
+                batch,
+            )
+            out.update(cur.fetchall())
+        conn.close()
+        return out
+
+    def save(self, source_url: str, target_url: str):
+        conn = sqlite3.connect(self.conninfo)
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT OR REPLACE INTO media_transfers (source_url, target_url)"
+            " VALUES (?, ?)",
+            (source_url, target_url),
+        )
+        conn.commit()
+        conn.close()
+
+
 @dataclass
 class ConfigEntry:
     key: str
@@ -338,3 +646,37 @@ def get_config_store(config: Config) -> ConfigStore:
     if "config" not in stores:
         stores["config"] = ConfigStore(PROJECT_DIR / config.database_location)
     return cast(ConfigStore, stores["config"])
+
+
+def get_imports_store(config: Config) -> ImportsStore:
+    if "imports" not in stores:
+        stores["imports"] = ImportsStore(PROJECT_DIR / config.database_location)
+    return cast(ImportsStore, stores["imports"])
+
+
+def get_migrated_rooms_store(config: Config) -> MigratedRoomsStore:
+    if "migrated_rooms" not in stores:
+        stores["migrated_rooms"] = MigratedRoomsStore(
+            PROJECT_DIR / config.database_location
+        )
+    return cast(MigratedRoomsStore, stores["migrated_rooms"])
+
+
+def get_event_mapping_store(config: Config) -> EventMappingStore:
+    return EventMappingStore(PROJECT_DIR / config.database_location)
+
+
+def get_media_transfer_store(config: Config) -> MediaTransferStore:
+    return MediaTransferStore(PROJECT_DIR / config.database_location)
+
+
+def get_uploads_store(config: Config) -> UploadsStore:
+    if "uploads" not in stores:
+        stores["uploads"] = UploadsStore(PROJECT_DIR / config.database_location)
+    return cast(UploadsStore, stores["uploads"])
+
+
+def get_downloads_store(config: Config) -> DownloadsStore:
+    if "downloads" not in stores:
+        stores["downloads"] = DownloadsStore(PROJECT_DIR / config.database_location)
+    return cast(DownloadsStore, stores["downloads"])
@@ -0,0 +1,8 @@
+CREATE TABLE imports (
+    id INTEGER PRIMARY KEY,
+    sha256 TEXT,
+    status TEXT,
+    event_id TEXT,
+    room_id TEXT,
+    new_room_id TEXT
+);
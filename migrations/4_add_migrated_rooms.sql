@@ -0,0 +1,13 @@
+CREATE TABLE migrated_rooms (
+    id INTEGER PRIMARY KEY,
+    source_room_id TEXT,
+    target_room_id TEXT,
+    last_event_id TEXT,
+    last_ts INTEGER
+);
+CREATE TABLE event_mappings (
+    source_event_id TEXT,
+    target_event_id TEXT,
+    target_room_id TEXT,
+    PRIMARY KEY (target_room_id, source_event_id)
+);
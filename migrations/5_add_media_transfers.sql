@@ -0,0 +1,4 @@
+CREATE TABLE media_transfers (
+    source_url TEXT PRIMARY KEY,
+    target_url TEXT
+);
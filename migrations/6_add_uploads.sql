@@ -0,0 +1,9 @@
+CREATE TABLE uploads (
+    id INTEGER PRIMARY KEY,
+    upload_id TEXT UNIQUE,
+    path TEXT,
+    size INTEGER,
+    user_id TEXT,
+    room_id TEXT,
+    event_id TEXT
+);
@@ -0,0 +1,7 @@
+CREATE TABLE downloads (
+    id INTEGER PRIMARY KEY,
+    url TEXT,
+    path TEXT,
+    room_id TEXT,
+    event_id TEXT
+);